@@ -0,0 +1,160 @@
+import os
+import random
+import shutil
+import sys
+import urllib.parse
+from io import BytesIO
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fin_an as fa
+
+# Сохраненные страницы smart-lab (python benchmarks/run.py --record SBER GAZP ...)
+recorded_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'smartlab')
+
+# Строки БФО: (название, код строки, знак)
+income_rows = [
+    ('Выручка 5', 2110, 1), ('Себестоимость продаж', 2120, -1), ('Валовая прибыль (убыток)', 2100, 1),
+    ('Коммерческие расходы', 2210, -1), ('Управленческие расходы', 2220, -1), ('Прибыль (убыток) от продаж', 2200, 1),
+    ('Доходы от участия в других организациях', 2310, 1), ('Проценты к получению', 2320, 1), ('Проценты к уплате', 2330, -1),
+    ('Прочие доходы', 2340, 1), ('Прочие расходы', 2350, -1), ('Прибыль (убыток) до налогообложения', 2300, 1),
+    ('Налог на прибыль 7', 2410, -1), ('в том числе: текущий налог на прибыль', 2411, -1), ('Прочее', 2460, 1),
+    ('Чистая прибыль (убыток)', 2400, 1), ('Совокупный финансовый результат периода', 2500, 1),
+]
+balance_rows = [
+    ('Нематериальные активы', 1110), ('Основные средства', 1150), ('Финансовые вложения', 1170), ('Итого по разделу I', 1100),
+    ('Запасы', 1210), ('Дебиторская задолженность', 1230), ('Прочие', 1231), ('Прочие', 1232), ('Финансовые вложения (за исключением денежных эквивалентов)', 1240),
+    ('Денежные средства и денежные эквиваленты', 1250), ('Прочие оборотные активы', 1260), ('Итого по разделу II', 1200),
+    ('БАЛАНС', 1600), ('Уставный капитал (складочный капитал, уставный фонд, вклады товарищей)', 1310),
+    ('Нераспределенная прибыль (непокрытый убыток)', 1370), ('Итого по разделу III', 1300), ('Заемные средства', 1410),
+    ('Итого по разделу IV', 1400), ('Заемные средства', 1510), ('Кредиторская задолженность', 1520),
+    ('Итого по разделу V', 1500), ('БАЛАНС', 1700),
+]
+cash_flow_rows = [
+    ('Денежные потоки от текущих операций', None, 0), ('Поступления - всего', 4110, 1),
+    ('в том числе:\n от продажи продукции, товаров, работ и услуг', 4111, 1), ('Платежи - всего', 4120, -1),
+    ('Сальдо денежных потоков от текущих операций', 4100, 1), ('Денежные потоки от инвестиционных операций', None, 0),
+    ('Платежи - всего', 4220, -1),
+    ('в том числе:\n в связи с приобретением, созданием, модернизацией, реконструкцией и подготовкой к использованию внеоборотных активов', 4221, -1),
+    ('Сальдо денежных потоков от инвестиционных операций', 4200, -1), ('Сальдо денежных потоков за отчетный период', 4400, 1),
+]
+
+smartlab_fields = ['revenue', 'ebitda', 'operating_income', 'net_income', 'capex', 'fcf', 'div_yield', 'assets', 'debt', 'cash',
+                   'eps', 'ebitda_margin', 'net_margin', 'roe', 'roa', 'p_e', 'p_s', 'p_bv', 'ev_ebitda', 'debt_ebitda', 'capex_revenue']
+
+
+def _amount(value):
+    # Числа в БФО записаны с пробелами между разрядами, отрицательные - в скобках
+    text = f'{abs(value):,}'.replace(',', ' ')
+    return f'({text})' if value < 0 else text
+
+def bfo_workbook(extra_rows=0, seed=0, with_cash_flow=True):
+    '''
+    Synthetic БФО excel file with the same layout as the ones from the ФНС site (bytes)
+    extra_rows - number of additional line items in the balance and the income statement to make the file bigger
+    '''
+    rnd = random.Random(seed)
+    wb = Workbook()
+    wb.remove(wb.active)
+
+    ws = wb.create_sheet('Бухгалтерский баланс')
+    for _ in range(4):
+        ws.append(['Форма'])
+    ws.append(['Пояснения', None, None, 'Наименование показателя', 'Код строки',
+               'На 31 декабря 2024 г.', 'На 31 декабря 2023 г.', 'На 31 декабря 2022 г.'])
+    ws.append([1, None, None, 2, 3, 4, 5, 6])
+    extra = [(f'Прочая статья баланса {i}', 1900 + i) for i in range(extra_rows)]
+    for name, code in balance_rows + extra:
+        ws.append([None, None, None, name, code] + [_amount(rnd.randint(1000, 900000)) for _ in range(3)])
+
+    ws = wb.create_sheet('Отчет о финансовых результатах')
+    for _ in range(4):
+        ws.append(['Форма'])
+    ws.append(['Пояснения', None, None, None, 'Наименование показателя', 'Код строки', 'За 2024 г.', 'За 2023 г.'])
+    ws.append([1, None, None, None, 2, 3, 4, 5])
+    extra = [(f'Прочая статья доходов {i}', 2900 + i, 1) for i in range(extra_rows)]
+    for name, code, sign in income_rows + extra:
+        ws.append([None, None, None, None, name, code] + [_amount(sign * rnd.randint(1000, 900000)) for _ in range(2)])
+
+    if with_cash_flow:
+        ws = wb.create_sheet('Отчет о движении денежных средс')
+        for _ in range(4):
+            ws.append(['Форма'])
+        ws.append(['Наименование показателя', 'Код строки', 'За 2024 г.', 'За 2023 г.'])
+        ws.append([1, 2, 3, 4])
+        for name, code, sign in cash_flow_rows:
+            values = ['-', '-'] if sign == 0 else [_amount(sign * rnd.randint(1000, 900000)) for _ in range(2)]
+            ws.append([name, code] + values)
+
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+def smartlab_page(extra_rows=0, seed=0, years=range(2015, 2026)):
+    '''
+    Synthetic smart-lab.ru page with the table of financial indicators (bytes),
+    extra_rows - number of additional indicators, about 10% of the cells are empty
+    '''
+    rnd = random.Random(seed)
+    years = [str(year) for year in years]
+    parts = ['<html><head><title>smart-lab</title></head><body><div class="menu">' + '<a href="#">link</a>' * 50 + '</div>',
+             '<table class="simple-little-table financials">',
+             '<tr class="header_row"><td></td>' + ''.join(f'<td><strong>{y}</strong></td>' for y in years) + '<td>LTM</td></tr>']
+    for field in smartlab_fields + [f'extra_{i}' for i in range(extra_rows)]:
+        cells = ''
+        for _ in years:
+            if rnd.random() > 0.1:
+                value = f'{rnd.randint(-5000, 50000):,}'.replace(',', ' ') + ('%' if 'margin' in field else '')
+                cells += f'<td>{value}</td>'
+            else:
+                cells += '<td></td>'
+        parts.append(f'<tr field="{field}"><th><a>{field.upper()}</a></th><td></td>{cells}<td>1</td></tr>')
+    parts.append('</table></body></html>')
+    return '\n'.join(parts).encode()
+
+def smartlab_url(ticker, types='MSFO'):
+    return f'{fa.base_url}/q/{ticker}/f/y/{types}/'
+
+def install_smartlab_pages(cache_dir, pages):
+    '''
+    Puts the pages {url: html} into cache_dir and switches fin_an to it in offline mode,
+    so get_smartlab_statements reads them from the disk as usual without going to the network
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    fa.cache_dir = cache_dir
+    fa.offline = True
+    for url, html in pages.items():
+        with open(fa._cache_path(url), 'wb') as f:
+            f.write(html)
+
+def record_smartlab_pages(tickers, types=('MSFO', 'RSBU')):
+    '''
+    Downloads the pages of the tickers into recorded_dir (needs network)
+    '''
+    os.makedirs(recorded_dir, exist_ok=True)
+    old_cache_dir = fa.cache_dir
+    fa.cache_dir = recorded_dir
+    try:
+        for ticker in tickers:
+            for t in types:
+                fa.download_html(smartlab_url(ticker, t))
+                print(f'recorded {ticker} {t}')
+    finally:
+        fa.cache_dir = old_cache_dir
+
+def use_recorded_pages(cache_dir):
+    '''
+    Copies the recorded pages into cache_dir and switches fin_an to it in offline mode,
+    returns [(ticker, type)] of the recorded pages (empty if nothing was recorded)
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    fa.cache_dir = cache_dir
+    fa.offline = True
+    found = []
+    if os.path.isdir(recorded_dir):
+        for name in sorted(os.listdir(recorded_dir)):
+            if name.endswith('.html'):
+                shutil.copy(os.path.join(recorded_dir, name), cache_dir)
+                parts = urllib.parse.unquote(name[:-len('.html')]).rstrip('/').split('/')
+                found.append((parts[-4], parts[-1]))
+    return found
@@ -0,0 +1,310 @@
+'''
+Offline benchmarks of the hot paths: БФО parsing and ratios, smart-lab parsing and bond pricing.
+Every benchmark is run at several input sizes, the time of every repeat and the peak memory
+(tracemalloc) are written to JSON, so the results of two commits can be compared
+
+    python benchmarks/run.py                      # all the benchmarks, results/<commit>.json
+    python benchmarks/run.py --quick -k bonds     # two smallest sizes of the bond benchmarks
+    python benchmarks/run.py --compare old.json new.json
+    python benchmarks/run.py --record SBER GAZP   # save real smart-lab pages for the offline runs
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+import fixtures
+import bfo
+import bfo_export
+import bfo_store
+import bonds
+import fin_an as fa
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+# Каждая функция подготовки получает размер входа и возвращает функцию без аргументов, время которой меряется
+
+def setup_income_statement(extra_rows):
+    data = fixtures.bfo_workbook(extra_rows)
+    return lambda: bfo.get_income_statement(BytesIO(data))
+
+def setup_balance(extra_rows):
+    data = fixtures.bfo_workbook(extra_rows)
+    return lambda: bfo.get_balance(BytesIO(data))
+
+def setup_balance_analysis(extra_rows):
+    data = fixtures.bfo_workbook(extra_rows)
+    return lambda: bfo.get_balance(BytesIO(data), analysis=True)
+
+def setup_balance_styles(extra_rows):
+    # Styler считает стили только при отрисовке, поэтому меряем to_html
+    styler, _ = bfo.get_balance(bfo.load_bfo_workbook(BytesIO(fixtures.bfo_workbook(extra_rows))), analysis=True)
+    return lambda: styler.to_html()
+
+def setup_cash_flow_statement(extra_rows):
+    data = fixtures.bfo_workbook(extra_rows)
+    return lambda: bfo.get_cash_flow_statement(BytesIO(data))
+
+def setup_ratios(extra_rows):
+    workbook = bfo.load_bfo_workbook(BytesIO(fixtures.bfo_workbook(extra_rows)))
+    return lambda: bfo.get_ratios(workbook)
+
+def setup_panel(n_companies):
+    # Разбираем несколько разных файлов и размножаем их под разными названиями компаний
+    templates = [bfo.parse_bfo_file(fixtures.bfo_workbook(seed=seed)) for seed in range(5)]
+    results = [(f'Компания {i}', bfo.statements_to_long(f'Компания {i}', templates[i % 5]), None) for i in range(n_companies)]
+    # Строки с одним названием (Прочие 1231 и 1232 в балансе) различаются кодом и не должны совпасть в индексе
+    if not bfo.build_panel(results[:1])[0].index.is_unique:
+        raise AssertionError('build_panel has duplicate index entries')
+    return lambda: bfo.build_panel(results)
+
+def setup_store_panel(n_companies):
+    # Хранилище создается во временном каталоге запуска (run подменяет им fa.cache_dir)
+    store = bfo_store.StatementStore(os.path.join(fa.cache_dir, f'store-{n_companies}'))
+    # Пустое хранилище и эмитенты, которых в нем нет, дают пустую таблицу, а не ошибку pyarrow
+    for issuers in [None, ['Нет такой компании']]:
+        if store.read(issuers=issuers, statements=['ОФР']).columns.tolist() != bfo_store.store_columns or not store.panel(issuers).empty:
+            raise AssertionError(f'StatementStore.read of {issuers} in an empty store is not an empty table')
+    templates = [bfo.statements_to_long('', bfo.parse_bfo_file(fixtures.bfo_workbook(seed=seed))) for seed in range(5)]
+    for i in range(n_companies):
+        store.add(f'Компания {i}', templates[i % 5], f'hash{i}')
+    if not store.read(issuers=['Нет такой компании']).empty or len(store.read(issuers=['Нет такой компании', 'Компания 0'])) == 0:
+        raise AssertionError('StatementStore.read does not skip the issuers that are not in the store')
+    return lambda: store.panel()
+
+def setup_export_excel(extra_rows):
+    workbook = bfo.load_bfo_workbook(BytesIO(fixtures.bfo_workbook(extra_rows)))
+    return lambda: bfo_export.export_excel(workbook)
+
+def setup_smartlab_table(extra_rows):
+    html = fixtures.smartlab_page(extra_rows)
+    return lambda: fa.parse_smartlab_table(html)
+
+def setup_smartlab_statements(extra_rows):
+    ticker = f'BENCH{extra_rows}'
+    fixtures.install_smartlab_pages(fa.cache_dir, {fixtures.smartlab_url(ticker): fixtures.smartlab_page(extra_rows)})
+    return lambda: fa.get_smartlab_statements(ticker, statements=None)
+
+def setup_recorded_smartlab(n_pages):
+    pages = fixtures.use_recorded_pages(fa.cache_dir)[:n_pages]
+    return lambda: [fa.get_smartlab_statements(ticker, statements=None, types=types) for ticker, types in pages]
+
+def _bond_universe(n_bonds, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(0.5, 30, n_bonds), 1000, rng.uniform(0, 0.2, n_bonds), rng.choice([1, 2, 4, 12], n_bonds))
+
+def setup_bond_price(n_bonds):
+    maturity, principal, coupon_rate, coupons_per_year = _bond_universe(n_bonds)
+    yields = np.linspace(0.01, 0.3, 50)
+    return lambda: bonds.price_bonds(maturity, principal, coupon_rate, coupons_per_year, yields)
+
+def setup_bond_price_scenarios(n_scenarios):
+    rates = bonds.simulate_short_rates(n_scenarios=n_scenarios, seed=0)
+    return lambda: bonds.bond_price(10, 1000, 0.08, 4, rates)
+
+def setup_simulate_bond(n_scenarios):
+    # Без волатильности доходность за каждый месяц равна плоской ставке: купоны приходят по тому же графику,
+    # что и в ценах (купон между месячными шагами засчитывается на следующем шаге, отсюда допуск для 2.1 года)
+    flat = 0.12
+    expected = (1 + flat / 4) ** (4 / 12) - 1
+    for maturity, tolerance in [(2.0, 1e-12), (2.1, 5e-4)]:
+        rates = next(bonds.short_rate_paths(r0=np.log1p(flat), b=np.log1p(flat), sigma=0, n_years=maturity, n_scenarios=1))
+        _, result = bonds.scenario_returns(maturity, 1000, 0.2, 4, rates)
+        deviation = np.abs(result.period_returns - expected).max()
+        if deviation > tolerance:
+            raise AssertionError(f'monthly returns of a {maturity}y bond with zero volatility deviate from the flat rate by {deviation:.2%}')
+    return lambda: bonds.simulate_bond(10, 1000, 0.08, 4, n_scenarios=n_scenarios, seed=0)
+
+def setup_solve_ytm(n_bonds):
+    maturity, principal, coupon_rate, coupons_per_year = _bond_universe(n_bonds)
+    prices = np.random.default_rng(1).uniform(700, 1200, n_bonds)
+    # Доходность и риск-метрики считаются по одному графику потоков: цена при найденной доходности равна исходной
+    result = bonds.solve_ytm(prices, maturity, principal, coupon_rate, coupons_per_year)
+    repriced = bonds.bond_risk(maturity, principal, coupon_rate, coupons_per_year, result.ytm).price
+    if not result.converged.all() or not np.allclose(repriced, prices, rtol=1e-8):
+        raise AssertionError('bond_risk at the solved YTM does not return the price')
+    return lambda: bonds.solve_ytm(prices, maturity, principal, coupon_rate, coupons_per_year)
+
+def setup_bond_risk(n_bonds):
+    maturity, principal, coupon_rate, coupons_per_year = _bond_universe(n_bonds)
+    return lambda: bonds.bond_risk(maturity, principal, coupon_rate, coupons_per_year, 0.1, key_rates=[1, 2, 5, 10, 30])
+
+def setup_total_returns(n_bonds):
+    maturity, principal, coupon_rate, coupons_per_year = _bond_universe(n_bonds)
+    prices = np.random.default_rng(2).uniform(900, 1100, (121, n_bonds, 20))
+    return lambda: bonds.total_returns(prices, maturity, principal, coupon_rate, coupons_per_year)
+
+def setup_immunize(n_bonds):
+    maturity, principal, coupon_rate, coupons_per_year = _bond_universe(n_bonds)
+    times = np.arange(1, 21)
+    return lambda: bonds.immunize(times, np.full(20, 1e6), maturity, principal, coupon_rate, coupons_per_year, 0.1, match_cash_flows=True)
+
+def setup_bond_portfolio(n_bonds):
+    rng = np.random.default_rng(3)
+    table = pd.DataFrame({column: rng.uniform(0, 10, n_bonds) for column in bonds.BondPortfolio.columns})
+    table['Market Price'] = rng.uniform(700, 1200, n_bonds)
+    names = [f'bond {i}' for i in range(n_bonds)]
+    # После удаления всех облигаций по одной суммы пусты, а не накопленная ошибка округления
+    portfolio = bonds.BondPortfolio()
+    ids = [portfolio.add(name, table.iloc[[i]])[0] for i, name in enumerate(names[:300])]
+    for i in rng.permutation(ids):
+        portfolio.remove(i)
+    result = portfolio.aggregates()
+    if result['Market Value'] != 0 or not all(np.isnan(result[column]) for column in bonds.BondPortfolio.weighted):
+        raise AssertionError(f'aggregates of an emptied portfolio are not empty: {result}')
+
+    def run():
+        portfolio = bonds.BondPortfolio()
+        ids = portfolio.add(names, table)
+        portfolio.remove(ids[::2])
+        return portfolio.aggregates()
+    return run
+
+# Название, функция подготовки, размеры входа
+benchmarks = [
+    ('bfo.get_income_statement', setup_income_statement, [0, 100, 1000]),
+    ('bfo.get_balance', setup_balance, [0, 100, 1000]),
+    ('bfo.get_balance analysis', setup_balance_analysis, [0, 100, 1000]),
+    ('bfo.get_balance analysis render', setup_balance_styles, [0, 100, 1000]),
+    ('bfo.get_cash_flow_statement', setup_cash_flow_statement, [0, 100, 1000]),
+    ('bfo.get_ratios', setup_ratios, [0, 100, 1000]),
+    ('bfo.build_panel', setup_panel, [10, 100, 1000]),
+    ('bfo_store.panel', setup_store_panel, [10, 100, 500]),
+    ('bfo_export.export_excel', setup_export_excel, [0, 100, 1000]),
+    ('fin_an.parse_smartlab_table', setup_smartlab_table, [0, 100, 1000]),
+    ('fin_an.get_smartlab_statements', setup_smartlab_statements, [0, 100, 1000]),
+    ('bonds.price_bonds', setup_bond_price, [100, 1000, 10000]),
+    ('bonds.bond_price scenarios', setup_bond_price_scenarios, [1000, 10000, 100000]),
+    ('bonds.simulate_bond', setup_simulate_bond, [1000, 10000, 50000]),
+    ('bonds.solve_ytm', setup_solve_ytm, [100, 1000, 10000]),
+    ('bonds.bond_risk', setup_bond_risk, [100, 1000, 10000]),
+    ('bonds.total_returns', setup_total_returns, [10, 100, 1000]),
+    ('bonds.immunize', setup_immunize, [100, 1000, 5000]),
+    ('bonds.BondPortfolio', setup_bond_portfolio, [1000, 10000, 100000]),
+]
+
+
+def measure(func, repeat):
+    '''
+    Runs func once to warm up, then repeat times for the time and once more under tracemalloc for the peak memory
+    '''
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def run(selected, repeat, quick):
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'versions': {'pandas': pd.__version__, 'numpy': np.__version__},
+        'repeat': repeat,
+        'results': [],
+    }
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fa.cache_dir = cache_dir
+        fa.offline = True
+        cases = list(selected)
+        # Записанные страницы smart-lab добавляются, только если они есть
+        n_recorded = len(fixtures.use_recorded_pages(cache_dir))
+        if n_recorded:
+            cases.append(('fin_an.get_smartlab_statements recorded', setup_recorded_smartlab, [n_recorded]))
+        for name, setup, scales in cases:
+            for scale in scales[:2] if quick else scales:
+                result = {'name': name, 'scale': scale}
+                try:
+                    times, peak = measure(setup(scale), repeat)
+                    result.update(times=times, min=min(times), median=statistics.median(times), peak_memory=peak)
+                    print(f'{name:40} {scale:>8} {result["median"] * 1000:12.2f} ms {peak / 2**20:10.1f} MB')
+                except Exception as e:
+                    # Упавший замер записывается с ошибкой, остальные продолжаются
+                    result['error'] = f'{type(e).__name__}: {e}'
+                    print(f'{name:40} {scale:>8} {result["error"]}')
+                report['results'].append(result)
+    return report
+
+def compare(old_path, new_path, threshold):
+    '''
+    Prints the ratio of the median times and peak memory of two result files,
+    returns the number of benchmarks that became slower than threshold
+    '''
+    with open(old_path) as f:
+        old = {(r['name'], r['scale']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {(r['name'], r['scale']): r for r in json.load(f)['results']}
+    slower = 0
+    print(f'{"benchmark":40} {"scale":>8} {"old ms":>10} {"new ms":>10} {"time":>7} {"memory":>7}')
+    for key in sorted(old.keys() & new.keys(), key=lambda k: (k[0], k[1])):
+        a, b = old[key], new[key]
+        if 'median' not in a or 'median' not in b:
+            print(f'{key[0]:40} {key[1]:>8} {a.get("error", "") or b.get("error", "")}')
+            continue
+        ratio = b['median'] / a['median']
+        memory = b['peak_memory'] / a['peak_memory'] if a['peak_memory'] else float('nan')
+        mark = ' slower' if ratio > threshold else ' faster' if ratio < 1 / threshold else ''
+        slower += ratio > threshold
+        print(f'{key[0]:40} {key[1]:>8} {a["median"] * 1000:10.2f} {b["median"] * 1000:10.2f} {ratio:6.2f}x {memory:6.2f}x{mark}')
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of bfo, fin_an and bonds')
+    parser.add_argument('-k', dest='filter', default='', help='run only the benchmarks with this substring in the name')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every benchmark')
+    parser.add_argument('--quick', action='store_true', help='only two smallest sizes')
+    parser.add_argument('--output', help='JSON file for the results (results/<commit>.json by default)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    parser.add_argument('--threshold', type=float, default=1.2, help='time ratio that counts as a regression')
+    parser.add_argument('--record', nargs='+', metavar='TICKER', help='download smart-lab pages of the tickers as fixtures')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(*args.compare, args.threshold) else 0
+    if args.record:
+        fixtures.record_smartlab_pages(args.record)
+        return 0
+
+    report = run([b for b in benchmarks if args.filter in b[0]], args.repeat, args.quick)
+    output = args.output or os.path.join(results_dir, f'{report["commit"] or "results"}{"-dirty" if report["dirty"] else ""}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+    print(f'results are saved to {output}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
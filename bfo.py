@@ -0,0 +1,791 @@
+import pandas as pd
+import numpy as np
+import fin_an as fa
+from profiling import timed, count
+from io import BytesIO
+from collections import namedtuple, OrderedDict
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import multiprocessing
+import itertools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+av = pd.DataFrame(columns=['Сравнение', 'Средние значения'])
+av.loc['Текущая ликвидность'] = ['>', 1.78]
+av.loc['Быстрая ликвиднсоть'] = ['>', 1.26]
+av.loc['Срочная ликвидность'] = ['>', 0.17]
+av.loc['ROS, %'] = ['>', 5.7]
+av.loc['EBIT Margin, %'] = ['>', 4.9]
+av.loc['ROA, %'] = ['>', 6.8]
+av.loc['ROE, %'] = ['>', 29.7]
+av.loc['Пер. об. Активов'] = ['<', 183]
+av.loc['Пер. об. Дебиторки'] = ['<', 62]
+av.loc['Пер. об. Запасов'] = ['<', 16]
+av.loc['Пер. об. Кредиторки'] = ['<', 90]
+av.loc['Коэф. автономии'] = ['>', 0.37]
+av.loc['Debt/Equity'] = ['<', 2]
+av.loc['Gearing'] = ['<', 0.7]
+av.loc['ICR'] = ['>', 5.96]
+av.loc['Net WC (КОСОС)'] = ['>', 0.26]
+av.loc['FCF Margin, %'] = ['>', 15]
+av.loc['FCF / Net Income'] = ['>', 1] # Лучше поставить равно
+av.loc['Cash Flow to Debt'] = ['>', 1.5]
+av.loc['EPS,руб'] = ['>', 10]
+av.loc['P/E'] = ['<', 7]
+av.loc['P/S'] = ['<', 2]
+av.loc['P/BV'] = ['<', 1] # Лучше поставить равно
+av.loc['EV/EBITDA'] = ['<', 12]
+av.loc['Долг/EBITDA'] = ['<', 2]
+
+# Строки отчетностей, из которых считаются коэффициенты: коды строк (если кодов несколько, строки складываются)
+ratio_items = pd.DataFrame(columns=['Отчетность', 'Коды'])
+ratio_items.loc['current_assets'] = ['Баланс', (1200,)]
+ratio_items.loc['current_liabilities'] = ['Баланс', (1500,)]
+ratio_items.loc['inventories'] = ['Баланс', (1210,)]
+ratio_items.loc['cash'] = ['Баланс', (1250,)]
+ratio_items.loc['short_investments'] = ['Баланс', (1240,)]
+ratio_items.loc['assets'] = ['Баланс', (1600,)]
+ratio_items.loc['equity'] = ['Баланс', (1300,)]
+ratio_items.loc['receivables'] = ['Баланс', (1230,)]
+ratio_items.loc['payables'] = ['Баланс', (1520,)]
+ratio_items.loc['debt'] = ['Баланс', (1410, 1510)]
+ratio_items.loc['revenue'] = ['ОФР', (2110,)]
+ratio_items.loc['cost_of_sales'] = ['ОФР', (2120,)]
+ratio_items.loc['operating_income'] = ['ОФР', (2200,)]
+ratio_items.loc['interest_paid'] = ['ОФР', (2330,)]
+ratio_items.loc['net_income'] = ['ОФР', (2400,)]
+ratio_items.loc['ocf'] = ['ОДДС', (4100,)]
+ratio_items.loc['capex'] = ['ОДДС', (4221,)]
+
+# Коэффициенты: Масштаб * Числитель / Знаменатель, где числитель и знаменатель - суммы статей из ratio_items
+# ('-' перед названием - статья вычитается, fcf = ocf + capex), сравнение со средними значениями берется из av
+ratio_registry = pd.DataFrame(columns=['Числитель', 'Знаменатель', 'Масштаб'])
+ratio_registry.loc['Текущая ликвидность'] = [('current_assets',), ('current_liabilities',), 1]
+ratio_registry.loc['Быстрая ликвиднсоть'] = [('current_assets', '-inventories'), ('current_liabilities',), 1]
+ratio_registry.loc['Срочная ликвидность'] = [('cash', 'short_investments'), ('current_liabilities',), 1]
+ratio_registry.loc['ROS, %'] = [('net_income',), ('revenue',), 100]
+ratio_registry.loc['EBIT Margin, %'] = [('operating_income',), ('revenue',), 100]
+ratio_registry.loc['ROA, %'] = [('net_income',), ('assets',), 100]
+ratio_registry.loc['ROE, %'] = [('net_income',), ('equity',), 100]
+ratio_registry.loc['Пер. об. Активов'] = [('assets',), ('revenue',), 365]
+ratio_registry.loc['Пер. об. Дебиторки'] = [('receivables',), ('revenue',), 365]
+ratio_registry.loc['Пер. об. Запасов'] = [('inventories',), ('cost_of_sales',), -365]
+ratio_registry.loc['Пер. об. Кредиторки'] = [('payables',), ('cost_of_sales',), -365]
+ratio_registry.loc['Коэф. автономии'] = [('equity',), ('assets',), 1]
+ratio_registry.loc['Debt/Equity'] = [('debt',), ('equity',), 1]
+ratio_registry.loc['Gearing'] = [('debt',), ('equity', 'debt'), 1]
+ratio_registry.loc['ICR'] = [('operating_income',), ('-interest_paid',), 1]
+ratio_registry.loc['Net WC (КОСОС)'] = [('current_assets', '-current_liabilities'), ('current_assets',), 1]
+# Можно еще добавить DSCR (инфа есть в гпт)
+ratio_registry.loc['Cash Flow to Debt'] = [('ocf',), ('debt',), 1]
+ratio_registry.loc['FCF Margin, %'] = [('fcf',), ('revenue',), 100]
+ratio_registry.loc['FCF / Net Income'] = [('fcf',), ('net_income',), 1]
+
+# Названия строк БФО по кодам (формы по приказу Минфина № 66н). Строки с одинаковыми названиями в разных
+# разделах (заемные средства, БАЛАНС, поступления и платежи ОДДС) различаются, строки с кодами не из этого
+# словаря называются как в файле
+line_names = {
+    # Бухгалтерский баланс
+    1110: 'Нематериальные активы',
+    1120: 'Результаты исследований и разработок',
+    1130: 'Нематериальные поисковые активы',
+    1140: 'Материальные поисковые активы',
+    1150: 'Основные средства',
+    1160: 'Доходные вложения в материальные ценности',
+    1170: 'Финансовые вложения',
+    1180: 'Отложенные налоговые активы',
+    1190: 'Прочие внеоборотные активы',
+    1100: 'Итого по разделу I',
+    1210: 'Запасы',
+    1220: 'Налог на добавленную стоимость по приобретенным ценностям',
+    1230: 'Дебиторская задолженность',
+    1240: 'Финансовые вложения (за исключением денежных эквивалентов)',
+    1250: 'Денежные средства и денежные эквиваленты',
+    1260: 'Прочие оборотные активы',
+    1200: 'Итого по разделу II',
+    1600: 'БАЛАНС (актив)',
+    1310: 'Уставный капитал (складочный капитал, уставный фонд, вклады товарищей)',
+    1320: 'Собственные акции, выкупленные у акционеров',
+    1340: 'Переоценка внеоборотных активов',
+    1350: 'Добавочный капитал (без переоценки)',
+    1360: 'Резервный капитал',
+    1370: 'Нераспределенная прибыль (непокрытый убыток)',
+    1300: 'Итого по разделу III',
+    1410: 'Заемные средства (долгосрочные)',
+    1420: 'Отложенные налоговые обязательства',
+    1430: 'Оценочные обязательства (долгосрочные)',
+    1450: 'Прочие обязательства (долгосрочные)',
+    1400: 'Итого по разделу IV',
+    1510: 'Заемные средства (краткосрочные)',
+    1520: 'Кредиторская задолженность',
+    1530: 'Доходы будущих периодов',
+    1540: 'Оценочные обязательства (краткосрочные)',
+    1550: 'Прочие обязательства (краткосрочные)',
+    1500: 'Итого по разделу V',
+    1700: 'БАЛАНС (пассив)',
+    # Отчет о финансовых результатах
+    2110: 'Выручка',
+    2120: 'Себестоимость продаж',
+    2100: 'Валовая прибыль (убыток)',
+    2210: 'Коммерческие расходы',
+    2220: 'Управленческие расходы',
+    2200: 'Прибыль (убыток) от продаж',
+    2310: 'Доходы от участия в других организациях',
+    2320: 'Проценты к получению',
+    2330: 'Проценты к уплате',
+    2340: 'Прочие доходы',
+    2350: 'Прочие расходы',
+    2300: 'Прибыль (убыток) до налогообложения',
+    2410: 'Налог на прибыль',
+    2411: 'Текущий налог на прибыль',
+    2412: 'Отложенный налог на прибыль',
+    2460: 'Прочее',
+    2400: 'Чистая прибыль (убыток)',
+    2510: 'Результат от переоценки внеоборотных активов, не включаемый в чистую прибыль (убыток) периода',
+    2520: 'Результат от прочих операций, не включаемый в чистую прибыль (убыток) периода',
+    2530: 'Налог на прибыль от операций, результат которых не включается в чистую прибыль (убыток) периода',
+    2500: 'Совокупный финансовый результат периода',
+    2900: 'Базовая прибыль (убыток) на акцию',
+    2910: 'Разводненная прибыль (убыток) на акцию',
+    # Отчет о движении денежных средств
+    4110: 'Поступления от текущих операций - всего',
+    4111: 'От продажи продукции, товаров, работ и услуг',
+    4112: 'Арендные платежи, лицензионные платежи, роялти, комиссионные и иные аналогичные платежи',
+    4113: 'От перепродажи финансовых вложений',
+    4119: 'Прочие поступления от текущих операций',
+    4120: 'Платежи по текущим операциям - всего',
+    4121: 'Поставщикам (подрядчикам) за сырье, материалы, работы, услуги',
+    4122: 'В связи с оплатой труда работников',
+    4123: 'Проценты по долговым обязательствам',
+    4124: 'Налог на прибыль организаций',
+    4129: 'Прочие платежи по текущим операциям',
+    4100: 'Сальдо денежных потоков от текущих операций',
+    4210: 'Поступления от инвестиционных операций - всего',
+    4211: 'От продажи внеоборотных активов (кроме финансовых вложений)',
+    4212: 'От продажи акций других организаций (долей участия)',
+    4213: 'От возврата предоставленных займов, от продажи долговых ценных бумаг',
+    4214: 'Дивиденды, проценты по долговым финансовым вложениям и аналогичные поступления',
+    4219: 'Прочие поступления от инвестиционных операций',
+    4220: 'Платежи по инвестиционным операциям - всего',
+    4221: 'В связи с приобретением, созданием, модернизацией, реконструкцией и подготовкой к использованию внеоборотных активов',
+    4222: 'В связи с приобретением акций других организаций (долей участия)',
+    4223: 'В связи с приобретением долговых ценных бумаг, предоставление займов другим лицам',
+    4224: 'Проценты по долговым обязательствам, включаемым в стоимость инвестиционного актива',
+    4229: 'Прочие платежи по инвестиционным операциям',
+    4200: 'Сальдо денежных потоков от инвестиционных операций',
+    4310: 'Поступления от финансовых операций - всего',
+    4311: 'Получение кредитов и займов',
+    4312: 'Денежные вклады собственников (участников)',
+    4313: 'От выпуска акций, увеличения долей участия',
+    4314: 'От выпуска облигаций, векселей и других долговых ценных бумаг',
+    4319: 'Прочие поступления от финансовых операций',
+    4320: 'Платежи по финансовым операциям - всего',
+    4321: 'Собственникам (участникам) в связи с выкупом у них акций (долей участия) или их выходом из состава участников',
+    4322: 'На уплату дивидендов и иных платежей по распределению прибыли в пользу собственников (участников)',
+    4323: 'В связи с погашением (выкупом) векселей и других долговых ценных бумаг, возврат кредитов и займов',
+    4329: 'Прочие платежи по финансовым операциям',
+    4300: 'Сальдо денежных потоков от финансовых операций',
+    4400: 'Сальдо денежных потоков за отчетный период',
+    4450: 'Остаток денежных средств и денежных эквивалентов на начало отчетного периода',
+    4500: 'Остаток денежных средств и денежных эквивалентов на конец отчетного периода',
+    4490: 'Величина влияния изменений курса иностранной валюты по отношению к рублю',
+}
+
+# Листы БФО, которые нужны парсерам: название листа и номер столбца с названиями строк
+bfo_sheets = {
+    'income_statement': ('Отчет о финансовых результатах', 4),
+    'balance': ('Бухгалтерский баланс', 3),
+    'cash_flow': ('Отчет о движении денежных средс', 0),
+}
+BFOWorkbook = namedtuple('BFOWorkbook', bfo_sheets.keys())
+
+@timed('excel: parse workbook')
+def load_bfo_workbook(file):
+    '''
+    opens БФО excel file only once (openpyxl read-only mode) and reads all the needed sheets in one pass,
+    returns BFOWorkbook(income_statement, balance, cash_flow) with raw sheets that get_* functions accept instead of the file
+    (if there is no sheet in the file, the corresponding field is None)
+    '''
+    sheets = {}
+    with pd.ExcelFile(file, engine='openpyxl') as xls:
+        for key, (sheet_name, index_col) in bfo_sheets.items():
+            if sheet_name in xls.sheet_names:
+                sheets[key] = xls.parse(sheet_name, header=4, index_col=index_col)
+            else:
+                sheets[key] = None
+    return BFOWorkbook(**sheets)
+
+def read_bfo_sheet(file, key):
+    '''
+    returns raw sheet of the statement either from already loaded BFOWorkbook or straight from the file
+    '''
+    sheet_name, index_col = bfo_sheets[key]
+    if isinstance(file, BFOWorkbook):
+        df = getattr(file, key)
+        if df is None:
+            raise ValueError(f'Worksheet named {sheet_name!r} not found')
+        return df
+    with timed('excel: parse sheet'):
+        return pd.read_excel(file, sheet_name=sheet_name, header=4, index_col=index_col, engine='openpyxl')
+
+def file_hash(file):
+    '''
+    returns sha256 of the file's content (file may be bytes, a path, UploadedFile or any binary file-like object)
+    '''
+    if isinstance(file, bytes):
+        data = file
+    elif isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            data = f.read()
+    elif hasattr(file, 'getvalue'):
+        data = file.getvalue()
+    else:
+        pos = file.tell()
+        data = file.read()
+        file.seek(pos)
+    return hashlib.sha256(data).hexdigest()
+
+def _nbytes(value):
+    # Примерный объем памяти, который занимает результат парсера
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if hasattr(value, 'data') and isinstance(value.data, pd.DataFrame):  # Styler
+        return _nbytes(value.data)
+    if isinstance(value, BytesIO):
+        return value.getbuffer().nbytes
+    return sys.getsizeof(value)
+
+
+# Версия результатов парсеров в ключе кэша: ее нужно увеличить, когда меняется то, что возвращают парсеры,
+# иначе из BFO_CACHE_DIR будут браться результаты старого формата
+cache_version = 2
+
+class StatementCache:
+    '''
+    LRU cache of parsed statements keyed by the file's content hash, parser and its options.
+    Memory tier is bounded by max_bytes (the least recently used results are evicted first),
+    if cache_dir is given, results are also pickled there and survive eviction and restarts.
+    Safe to share between the threads of one process (streamlit sessions)
+    '''
+    def __init__(self, max_bytes=256 * 2**20, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f'{name}.pkl')
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key][0]
+        if self.cache_dir and os.path.exists(self._path(key)):
+            with open(self._path(key), 'rb') as f:
+                value = pickle.load(f)
+            self.put(key, value, to_disk=False)
+            return value
+        return default
+
+    def put(self, key, value, to_disk=True):
+        size = _nbytes(value)
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.nbytes += size
+            # Выкидываем самые старые результаты, но последний оставляем, даже если он больше лимита
+            while self.nbytes > self.max_bytes and len(self._items) > 1:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self.nbytes -= old_size
+        if to_disk and self.cache_dir:
+            # Styler с функциями форматирования не сериализуется, такие результаты храним только в памяти
+            try:
+                data = pickle.dumps(value)
+            except Exception:
+                return
+            # Пишем во временный файл и подменяем, чтобы другой поток не прочитал недописанный файл
+            path = self._path(key)
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def parse(self, func, file, **options):
+        '''
+        returns func(file, **options) from the cache, parses the file only if it is not there yet
+        '''
+        key = (cache_version, file_hash(file), func.__name__, tuple(sorted(options.items())))
+        value = self.get(key, default=key)
+        if value is key:
+            count('statement cache: misses')
+            value = func(file, **options)
+            self.put(key, value)
+        else:
+            count('statement cache: hits')
+        return value
+
+
+def index_by_code(df):
+    '''
+    takes the raw sheet (names of the rows in the index, 'Код строки' column) and indexes it by
+    (line code, name) with the names from line_names, the rows without line code (section headers,
+    the row with the numbers of the columns) are dropped
+    '''
+    codes = pd.to_numeric(df['Код строки'], errors='coerce').to_numpy()
+    mask = codes >= 1000
+    df = df[mask].drop(columns='Код строки')
+    codes = codes[mask].astype(int)
+    # Для неизвестных кодов - название из файла без "в том числе:", номеров пояснений и лишних пробелов
+    labels = (df.index.astype(str).str.replace(r'^\s*в том числе:?', '', regex=True).str.replace(r'\s+\d+$', '', regex=True)
+              .str.replace(r'\s+', ' ', regex=True).str.strip())
+    names = [line_names.get(code, label) for code, label in zip(codes, labels)]
+    df.index = pd.MultiIndex.from_arrays([codes, names], names=['Код строки', 'Показатель'])
+    return df
+
+def get_line(df, code):
+    '''
+    row of the statement indexed by index_by_code with the given line code (Series of the periods)
+    '''
+    return df.iloc[df.index.get_level_values('Код строки').get_loc(code)]
+
+# Условное форматирование: цвета всех ячеек считаются сразу по всей таблице и передаются в Styler одним вызовом.
+# Styler передает стиль каждой ячейки отдельно, поэтому таблицы больше max_styled_cells показываются без него
+max_styled_cells = 50_000
+
+def sign_styles(df, columns):
+    '''
+    css of all the cells of df: green for positive and red for negative values of the columns, empty for the rest
+    '''
+    values = df[columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    styles = pd.DataFrame('', index=df.index, columns=df.columns)
+    styles[columns] = np.where(values > 0, 'color: green', np.where(values < 0, 'color: red', ''))
+    return styles
+
+def benchmark_styles(df, columns, names=None):
+    '''
+    css of all the cells of df: the values of the columns are green if they are better than the average of av
+    for the ratio and red if they are worse, names - ratio of every row (the index of df by default)
+    '''
+    names = df.index if names is None else names
+    benchmarks = av.reindex(names)
+    sign = benchmarks['Сравнение'].to_numpy()[:, None]
+    avg = benchmarks['Средние значения'].to_numpy(dtype=float)[:, None]
+    values = df[columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    better = ((sign == '>') & (values > avg)) | ((sign == '<') & (values < avg))
+    worse = ((sign == '>') & (values < avg)) | ((sign == '<') & (values > avg))
+    styles = pd.DataFrame('', index=df.index, columns=df.columns)
+    styles[columns] = np.where(better, 'color: green', np.where(worse, 'color: red', ''))
+    return styles
+
+def apply_styles(df, styles, formats):
+    '''
+    Styler of df with the precomputed css of all the cells and the formats,
+    df itself (without colors and formats) if it has more than max_styled_cells cells
+    '''
+    if df.size > max_styled_cells:
+        count('styles: unstyled tables')
+        return df
+    return df.style.apply(lambda _: styles, axis=None).format(formats)
+
+@timed('statements: ОФР')
+def get_income_statement(file, dropna=False, analysis=False, excel_file=False):
+    '''
+    takes garbage БФО excel file and turns it into normal one
+    '''
+    df = read_bfo_sheet(file, 'income_statement')
+    pattern = r'^Код строки$|^За\s\d{4}\sг\.'
+    df = index_by_code(df.filter(regex=pattern))
+    # От выручки до чистой прибыли
+    codes = df.index.get_level_values('Код строки')
+    df = df.iloc[codes.get_loc(2110):codes.get_loc(2400) + 1]
+    df = df.replace(' ', '', regex=True).replace(r'\(', '-', regex=True).replace(r'\)', '', regex=True)
+    df = df.apply(pd.to_numeric, errors='coerce')
+
+    if dropna:
+        df = df.dropna()
+
+    # Вертикальный и горизонтальный анализ (база для вертикального - выручка)
+    if analysis:
+        years = df.columns.str.extract(r'(\d{4})')[0]
+        hor_an = fa.horizontal_analysis(df)
+        hor_an.columns = [f'{year1} / {year0}' for year1, year0 in zip(years[:-1], years[1:])]
+        ver_an = fa.vertical_analysis(df, get_line(df, 2110), absolute=True)
+        ver_an.columns = [f'Доля в выручке {year}' for year in years]
+        df = pd.concat([df, hor_an, ver_an], axis=1)
+
+        # Стилизация
+        # Находим столбцы анализа, чтобы форматировать только их. 
+        # Также находим оригинальные столбцы и столбцы для вертикального анализа, чтобы их нормально отформатировать
+        hor_analysis_cols = [col for col in df.columns if "/" in col]
+        ver_analysis_cols = [col for col in df.columns if "Доля" in col]
+        orig_cols = [col for col in df.columns if "За" in col]
+
+        
+        # Чтобы один формат не перебивал другой
+        formats = {col: "{:.2f}%" for col in hor_analysis_cols}
+        formats.update({col: "{:.2f}%" for col in ver_analysis_cols})
+        formats.update({col: "{:,.0f}" for col in orig_cols})
+        
+        return apply_styles(df, sign_styles(df, hor_analysis_cols), formats), None
+
+    # Скачивать ли эксель файл
+    if excel_file:
+        output = BytesIO()
+        df.to_excel(output)
+        output.seek(0)
+        return df, output
+            
+    return df, None
+
+    
+
+@timed('statements: баланс')
+def get_balance(file, dropna=False, analysis=False, excel_file=False):
+    '''
+    takes garbage БФО excel file and turns it into normal one,
+    gives you only necessary items, the extra ones are excluded
+    '''
+    df = read_bfo_sheet(file, 'balance')
+    pattern = r'^Код строки$|^На \d{1,2} [а-яё]+ \d{4} г\.$'
+    df = index_by_code(df.filter(regex=pattern, axis=1))
+    df = df.replace(' ', '', regex=True).replace(r'\(', '-', regex=True).replace(r'\)', '', regex=True)
+    df = df.apply(pd.to_numeric, errors='coerce')
+
+    if dropna:
+        df = df.dropna()
+
+    # Вертикальный и горизонтальный анализ (база для вертикального - итог баланса)
+    if analysis:
+        years = df.columns.str.extract(r'(\d{4})')[0]
+        hor_an = fa.horizontal_analysis(df)
+        hor_an.columns = [f'{year1} / {year0}' for year1, year0 in zip(years[:-1], years[1:])]
+        ver_an = fa.vertical_analysis(df, get_line(df, 1600))
+        ver_an.columns = [f'Доля в балансе {year}' for year in years]
+        df = pd.concat([df, hor_an, ver_an], axis=1)
+
+        # Начало стилизации
+        # Находим столбцы анализа, чтобы форматировать только их. 
+        # Также находим оригинальные столбцы и столбцы для вертикального анализа, чтобы их нормально отформатировать
+        hor_analysis_cols = [col for col in df.columns if "/" in col]
+        ver_analysis_cols = [col for col in df.columns if "Доля" in col]
+        orig_cols = [col for col in df.columns if "На" in col]
+
+        # Чтобы один формат не перебивал другой
+        formats = {col: "{:.2f}%" for col in hor_analysis_cols}
+        formats.update({col: "{:.2f}%" for col in ver_analysis_cols})
+        formats.update({col: "{:,.0f}" for col in orig_cols})
+        
+        return apply_styles(df, sign_styles(df, hor_analysis_cols), formats), None
+
+    # Скачивать ли эксель файл
+    if excel_file:
+        output = BytesIO()
+        df.to_excel(output)
+        output.seek(0)
+        return df, output
+
+    return df, None
+
+
+
+@timed('statements: ОДДС')
+def get_cash_flow_statement(file, only_OCF_FCF=False, dropna=False, analysis=False, excel_file=False):
+    '''
+    takes garbage БФО excel file and turns it into normal one
+    '''
+    try:
+        df = read_bfo_sheet(file, 'cash_flow')
+    except:
+        return print('Такой отчетности нет в файле')
+    pattern = r'^Код строки$|За\s\d{4}\sг\.'
+    df = index_by_code(df.filter(regex=pattern, axis=1))
+    df = df[~df.apply(lambda row: all(val in ['-', '(-)'] for val in row), axis=1)]
+    df = df.replace(' ', '', regex=True).replace(r'\(', '-', regex=True).replace(r'\)', '', regex=True)
+    df = df.apply(pd.to_numeric, errors='coerce')
+
+    # Возвращает только OCF и FCF
+    if only_OCF_FCF:
+        OCF = get_line(df, 4100)
+        # Если строки с капвложениями нет, FCF = OCF
+        codes = df.index.get_level_values('Код строки')
+        FCF = OCF + get_line(df, 4221) if 4221 in codes else OCF
+        return OCF, FCF
+        
+    if dropna:
+        df = df.dropna()   
+
+    # Горизонтальный анализ
+    if analysis:
+        years = df.columns.str.extract(r'(\d{4})')[0]
+        hor_an = fa.horizontal_analysis(df)
+        hor_an.columns = [f'{year1} / {year0}' for year1, year0 in zip(years[:-1], years[1:])]
+        df = pd.concat([df, hor_an], axis=1)
+
+        # Стилизация
+        # Находим столбцы анализа, чтобы форматировать только их. 
+        # Также находим оригинальные столбцы и столбцы для горизонтального анализа, чтобы их нормально отформатировать
+        hor_analysis_cols = [col for col in df.columns if "/" in col]
+        orig_cols = [col for col in df.columns if col not in hor_analysis_cols]
+ 
+        # Чтобы один формат не перебивал другой
+        formats = {col: "{:.2f}%" for col in hor_analysis_cols}
+        formats.update({col: "{:,.0f}" for col in orig_cols})
+        
+        return apply_styles(df, sign_styles(df, hor_analysis_cols), formats), None
+
+    # Скачивать ли эксель файл
+    if excel_file:
+        output = BytesIO()
+        df.to_excel(output)
+        output.seek(0)
+        return df, output
+
+    return df, None
+
+
+
+@timed('smartlab: ratios')
+def get_smartlab_ratios(ticker, statements_RSBU=['eps', 'p_e', 'p_s', 'p_bv'], statements_MSFO=['ev_ebitda', 'debt_ebitda'], years=['2024', '2023']):
+    '''
+    searches for required ratios of the given company on smartlab (both RSBU and MSFO pages)
+    and returns a DataFrame with them
+    '''
+    # Обе страницы загружаются параллельно
+    df = fa.get_smartlab_many([ticker], statements={'RSBU': statements_RSBU, 'MSFO': statements_MSFO}, target_years=years)
+    if df.empty:
+        raise ValueError(f'Ticker {ticker} is invalid')
+    return df.droplevel(['ticker', 'type'])
+
+
+def get_ratio_items(statements):
+    '''
+    takes dict {statement name: DataFrame} of one company (indexed by index_by_code, periods in columns)
+    and returns table of ratio_items with periods in rows, the items that are not in statements are skipped
+    '''
+    items = {}
+    for statement, df in statements.items():
+        # Строки ищутся по коду в хэш-индексе, а не по названию
+        by_code = df.set_axis(df.index.get_level_values('Код строки'))
+        for item, codes in ratio_items.loc[ratio_items['Отчетность'] == statement, 'Коды'].items():
+            found = [code for code in codes if code in by_code.index]
+            if found:
+                rows = by_code.loc[found]
+                items[item] = rows.sum(axis=0) if len(codes) > 1 else rows.iloc[0]
+    items = pd.DataFrame(items)
+    if 'ocf' in items:
+        items['fcf'] = items['ocf'] + items.get('capex', 0)
+    return items
+
+def get_panel_ratio_items(panel):
+    '''
+    takes long panel of statements (as build_panel returns) and returns table of ratio_items
+    for all companies at once with (company, year) in rows
+    '''
+    long = panel.reset_index()
+    # Коды строк уникальны во всех формах БФО, поэтому статья находится по одному коду
+    codes = ratio_items['Коды'].explode()
+    items_by_code = pd.Series(codes.index, index=codes.to_numpy(dtype=int))
+    long = long.assign(item=long['code'].map(items_by_code)).dropna(subset='item')
+    items = long.groupby(['company', 'year', 'item'])['value'].sum(min_count=1).unstack('item')
+    if 'ocf' in items:
+        # Если строки с капвложениями нет, FCF = OCF
+        capex = items['capex'].fillna(0) if 'capex' in items else 0
+        items['fcf'] = items['ocf'] + capex
+    return items
+
+@timed('ratios: compute')
+def compute_ratios(items, registry=ratio_registry):
+    '''
+    calculates every ratio of the registry as one vectorized operation over all rows of items
+    (rows are periods of one company or (company, year) of a panel), the items are taken once and shared by all ratios,
+    the ratios which need the items that are not in the table are skipped
+    '''
+    values = {col: items[col].to_numpy(dtype=float) for col in items.columns}
+
+    def total(terms):
+        # Сумма статей, статьи с '-' вычитаются
+        return sum(-values[term[1:]] if term.startswith('-') else values[term] for term in terms)
+
+    ratios = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, (numerator, denominator, scale) in registry.iterrows():
+            if all(term.lstrip('-') in values for term in numerator + denominator):
+                ratios[name] = scale * total(numerator) / total(denominator)
+    return pd.DataFrame(ratios, index=items.index)
+
+def get_panel_ratios(panel):
+    '''
+    calculates ratios for all companies and years of the long panel in one batch,
+    returns DataFrame with (company, year) in rows and ratios in columns
+    '''
+    return compute_ratios(get_panel_ratio_items(panel)).round(2)
+
+def get_ratios(IS, balance=None, OCF=None, FCF=None, smartlab_df=None, extra_ratios=True, styled=False):
+    # Вместо готовых таблиц можно передать BFOWorkbook, тогда отчетности достаются из него
+    if isinstance(IS, BFOWorkbook):
+        workbook = IS
+        IS, _ = get_income_statement(workbook)
+        balance, _ = get_balance(workbook)
+        if extra_ratios and OCF is None and FCF is None and workbook.cash_flow is not None:
+            OCF, FCF = get_cash_flow_statement(workbook, only_OCF_FCF=True)
+
+    balance = balance.drop(balance.columns[-1], axis=1)
+    balance.columns = IS.columns
+    items = get_ratio_items({'ОФР': IS, 'Баланс': balance})
+    if extra_ratios:
+        items['ocf'] = OCF
+        items['fcf'] = FCF
+    ratios = compute_ratios(items).T
+
+    if extra_ratios:
+        try:
+            smartlab_df.columns = IS.columns
+            ratios = pd.concat([ratios, smartlab_df], axis=0) 
+            ratios = ratios.apply(pd.to_numeric, errors='coerce')
+        except: 
+            ratios = ratios
+
+    ratios = ratios.round(2)
+    
+    common_index = ratios.index.intersection(av.index)
+    ratios = pd.concat([ratios.loc[common_index], av.loc[common_index]], axis=1)
+
+    # Применением при необходимости
+    if styled:
+        numbers = ratios.columns[:-2]
+        return apply_styles(ratios, benchmark_styles(ratios, numbers),
+                            {col: '{:,.2f}' for col in ratios.select_dtypes('number').columns})
+
+    return ratios
+
+
+# Пакетная обработка нескольких файлов
+def _file_bytes(file):
+    # В процессы передаем только байты: UploadedFile и открытые файлы не сериализуются
+    if isinstance(file, bytes):
+        return file
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            return f.read()
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    return file.read()
+
+def parse_bfo_file(data):
+    '''
+    parses all the statements of one БФО file (given as bytes) with the get_* functions,
+    returns dict {statement name: DataFrame}
+    '''
+    workbook = load_bfo_workbook(BytesIO(data))
+    statements = {}
+    statements['ОФР'], _ = get_income_statement(workbook)
+    statements['Баланс'], _ = get_balance(workbook)
+    if workbook.cash_flow is not None:
+        statements['ОДДС'], _ = get_cash_flow_statement(workbook)
+    return statements
+
+# Индекс длинной панели: у разных строк отчетности может быть одно название, поэтому в нем и код строки
+panel_index = ['company', 'year', 'code', 'line item']
+
+def statements_to_long(company, statements):
+    '''
+    turns dict of statements of one company into long DataFrame
+    with (company, year, code, line item) index (code is the line code) and statement, value columns
+    '''
+    parts = []
+    for statement, df in statements.items():
+        df = df.copy()
+        df.columns = df.columns.str.extract(r'(\d{4})')[0].astype(int)
+        long = df.rename_axis(index=['code', 'line item'], columns='year').stack().rename('value').reset_index()
+        long.insert(0, 'statement', statement)
+        parts.append(long)
+    panel = pd.concat(parts, ignore_index=True)
+    panel.insert(0, 'company', company)
+    return panel.set_index(panel_index)
+
+def process_bfo_files(files, max_workers=None):
+    '''
+    parses БФО files in a process pool,
+    files - iterable of (company, file) pairs, file is a path, bytes or binary file-like object (UploadedFile too)
+    yields (company, long DataFrame or None, error or None) as soon as each file is done
+    '''
+    # spawn, а не fork: streamlit многопоточный, и fork из него может зависнуть
+    context = multiprocessing.get_context('spawn')
+    workers = max_workers or os.cpu_count() or 1
+    files = iter(files)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        # В очереди держим только несколько файлов на процесс, чтобы не читать весь каталог в память сразу
+        pending = {}
+        while True:
+            for company, file in itertools.islice(files, 4 * workers - len(pending)):
+                count('batch: files')
+                try:
+                    pending[pool.submit(parse_bfo_file, _file_bytes(file))] = company
+                except OSError as e:
+                    yield company, None, e
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                company = pending.pop(future)
+                try:
+                    yield company, statements_to_long(company, future.result()), None
+                except Exception as e:
+                    yield company, None, e
+
+def add_panel_ratios(panel):
+    '''
+    appends the ratios of all companies and years of the long panel to it as 'Коэффициенты' statement
+    '''
+    # Коэффициенты считаются одним расчетом сразу по всем компаниям
+    ratios = get_panel_ratios(panel).rename_axis(columns='line item').stack().dropna().rename('value').reset_index()
+    ratios.insert(2, 'statement', 'Коэффициенты')
+    panel = pd.concat([panel.reset_index(), ratios], ignore_index=True)
+    # У коэффициентов нет кода строки
+    panel['code'] = panel['code'].astype('Int64')
+    return panel.set_index(panel_index)
+
+def failed_files(results):
+    '''
+    DataFrame of the files that failed in the results of process_bfo_files (or StatementStore.ingest) with their errors
+    '''
+    errors = [(company, f'{type(error).__name__}: {error}') for company, _, error in results if error is not None]
+    return pd.DataFrame(errors, columns=['Файл', 'Ошибка'])
+
+def build_panel(results):
+    '''
+    merges results of process_bfo_files into one long panel,
+    returns (panel, errors) where errors is DataFrame with the files that failed
+    '''
+    results = list(results)
+    frames = [long for _, long, error in results if error is None]
+    if frames:
+        panel = add_panel_ratios(pd.concat(frames))
+    else:
+        index = pd.MultiIndex.from_tuples([], names=panel_index)
+        panel = pd.DataFrame(columns=['statement', 'value'], index=index)
+    return panel, failed_files(results)
@@ -0,0 +1,112 @@
+'''
+Headless batch processing of БФО files: parses every .xlsx file of the directory on N worker processes
+and writes the cleaned statements, ratios and the report of the failed files
+
+    python bfo_batch.py reports/ -o output/ -j 8
+    python bfo_batch.py reports/ -o output/ --format csv --recursive
+    python bfo_batch.py reports/ -o output/ --store bfo_store    # files already in the store are not parsed again
+
+Output (the company is the file name without extension):
+    statements.parquet - long table company, year, code (line code), line item, statement, value
+    ratios.parquet     - ratios of every company and year, calculated as get_ratios in the app; the oldest year
+                         of the balance (no income statement for it) also gets the ratios of the balance alone,
+                         which get_ratios leaves out
+    failures.csv       - files that could not be processed and the errors
+'''
+import argparse
+import os
+import sys
+import time
+
+from bfo import process_bfo_files, build_panel, failed_files
+from bfo_store import StatementStore
+
+
+def find_bfo_files(directory, recursive=False):
+    '''
+    (company, path) pairs of the .xlsx files in the directory, the company is the file name without extension
+    '''
+    paths = []
+    if recursive:
+        for folder, _, names in os.walk(directory):
+            paths.extend(os.path.join(folder, name) for name in names)
+    else:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)]
+    # Временные файлы Excel (~$...) пропускаем
+    paths = sorted(p for p in paths if p.lower().endswith('.xlsx') and not os.path.basename(p).startswith('~$'))
+    return [(os.path.splitext(os.path.basename(p))[0], p) for p in paths]
+
+def split_panel(panel):
+    '''
+    Splits the panel of build_panel into the long table of the statements and the wide table of the ratios
+    '''
+    is_ratio = panel['statement'] == 'Коэффициенты'
+    statements = panel[~is_ratio].reset_index()
+    # У коэффициентов нет кода строки
+    ratios = panel.loc[is_ratio, 'value'].droplevel('code').unstack('line item').rename_axis(columns=None).reset_index()
+    return statements, ratios
+
+def write_table(df, path, file_format):
+    if file_format == 'parquet':
+        df.to_parquet(f'{path}.parquet', index=False)
+    else:
+        df.to_csv(f'{path}.csv', index=False, encoding='utf-8-sig')
+
+def run(directory, output, workers=None, file_format='parquet', recursive=False, quiet=False, store=None):
+    '''
+    Processes all the БФО files of the directory and writes the results to output,
+    if store (directory of StatementStore) is given, the files are added to it and only the new ones are parsed,
+    returns (number of files, number of failed files)
+    '''
+    files = find_bfo_files(directory, recursive)
+    start = time.perf_counter()
+    if store is None:
+        results = ((company, long, error, 'ok') for company, long, error in process_bfo_files(files, max_workers=workers))
+    else:
+        store = StatementStore(store)
+        results = ((company, None, error, status) for company, status, error in store.ingest(files, max_workers=workers))
+    done = []
+    for company, long, error, status in results:
+        done.append((company, long, error))
+        if not quiet:
+            status = status if error is None else f'ОШИБКА {type(error).__name__}: {error}'
+            print(f'[{len(done)}/{len(files)}] {company}: {status}', file=sys.stderr)
+    if store is None:
+        panel, failures = build_panel(done)
+    else:
+        # Панель читается из хранилища, в ней и только что разобранные файлы, и сохраненные ранее
+        failures = failed_files(done)
+        panel = store.panel([company for company, _, error in done if error is None])
+    statements, ratios = split_panel(panel)
+
+    os.makedirs(output, exist_ok=True)
+    write_table(statements, os.path.join(output, 'statements'), file_format)
+    write_table(ratios, os.path.join(output, 'ratios'), file_format)
+    failures.to_csv(os.path.join(output, 'failures.csv'), index=False, encoding='utf-8-sig')
+    if not quiet:
+        print(f'{len(files) - len(failures)} of {len(files)} files processed in {time.perf_counter() - start:.1f} s, '
+              f'results are in {output}', file=sys.stderr)
+    return len(files), len(failures)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch processing of БФО excel files')
+    parser.add_argument('directory', help='directory with БФО .xlsx files')
+    parser.add_argument('-o', '--output', default='bfo_output', help='directory for the results (bfo_output by default)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (number of CPUs by default)')
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet', help='format of the statements and ratios')
+    parser.add_argument('--recursive', action='store_true', help='also look for files in the subdirectories')
+    parser.add_argument('--store', metavar='DIR', help='statement store: add the files to it and skip the ones already there')
+    parser.add_argument('--strict', action='store_true', help='exit with code 1 if any file failed')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not print the progress')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f'{args.directory} is not a directory')
+    n_files, n_failed = run(args.directory, args.output, args.workers, args.format, args.recursive, args.quiet, args.store)
+    # Ошибка, если не обработался ни один файл (или хотя бы один в режиме --strict)
+    if n_failed and (args.strict or n_failed == n_files):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
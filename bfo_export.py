@@ -0,0 +1,74 @@
+'''
+Export of the cleaned БФО statements: one excel file with a sheet for every statement and the ratios,
+which is built only when it is downloaded, and the batch panel in parquet, csv or excel
+'''
+import importlib.util
+from io import BytesIO
+
+import pandas as pd
+
+from bfo import BFOWorkbook, load_bfo_workbook, get_income_statement, get_balance, get_cash_flow_statement, get_ratios
+from profiling import timed
+
+# xlsxwriter пишет excel в несколько раз быстрее openpyxl, но он необязателен
+excel_engine = 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') is not None else 'openpyxl'
+
+mime_types = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+    'csv': 'text/csv',
+}
+
+
+def statement_sheets(file, dropna=False):
+    '''
+    cleaned statements and ratios of one БФО file (path, bytes, file-like object or already loaded BFOWorkbook),
+    returns dict {sheet name: DataFrame}, there is no ОДДС sheet if the file has no cash flow statement
+    '''
+    if isinstance(file, bytes):
+        file = BytesIO(file)
+    workbook = file if isinstance(file, BFOWorkbook) else load_bfo_workbook(file)
+    sheets = {}
+    sheets['ОФР'], _ = get_income_statement(workbook, dropna=dropna)
+    sheets['Баланс'], _ = get_balance(workbook, dropna=dropna)
+    if workbook.cash_flow is not None:
+        sheets['ОДДС'], _ = get_cash_flow_statement(workbook, dropna=dropna)
+    sheets['Коэффициенты'] = get_ratios(workbook, extra_ratios=workbook.cash_flow is not None)
+    return sheets
+
+@timed('export: excel')
+def write_excel(sheets):
+    '''
+    writes {sheet name: DataFrame} into one excel file, returns its bytes
+    '''
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine=excel_engine) as writer:
+        for name, df in sheets.items():
+            # Название листа в excel не длиннее 31 символа
+            df.to_excel(writer, sheet_name=name[:31])
+    return output.getvalue()
+
+def export_excel(file, dropna=False):
+    '''
+    excel file (bytes) with ОФР, Баланс, ОДДС and Коэффициенты sheets of one БФО file,
+    with StatementCache.parse(export_excel, file) it is built once per file content
+    '''
+    return write_excel(statement_sheets(file, dropna))
+
+@timed('export: panel')
+def export_panel(panel, file_format='parquet'):
+    '''
+    bytes of the long panel (build_panel or StatementStore.panel) in one of the formats:
+    parquet and csv - the long table as it is (parquet is much smaller and faster for big batches),
+    xlsx - a sheet for every statement with (company, code, line item) in rows and years in columns
+    '''
+    if file_format == 'parquet':
+        output = BytesIO()
+        panel.reset_index().to_parquet(output, index=False)
+        return output.getvalue()
+    if file_format == 'csv':
+        return panel.to_csv().encode('utf-8-sig')
+    if file_format == 'xlsx':
+        wide = panel.set_index('statement', append=True)['value'].unstack('year')
+        return write_excel({statement: df.droplevel('statement') for statement, df in wide.groupby(level='statement', sort=False)})
+    raise ValueError(f'Unknown file format {file_format!r}, expected one of {list(mime_types)}')
@@ -0,0 +1,242 @@
+'''
+Local columnar store of the cleaned БФО statements and ratios, so every file is parsed with openpyxl only once
+
+    store = StatementStore('bfo_store')
+    for company, status, error in store.ingest([('Ромашка', 'reports/Ромашка.xlsx')]): ...
+    store.panel(['Ромашка'])                                   # the same long panel as build_panel
+    store.read(['year', 'value'], issuers=['Ромашка'], statements=['ОФР'])
+
+Every ingested file is one parquet file keyed by the issuer, the period (the last year of the file)
+and sha256 of the file's content, manifest.parquet lists them. A file that is already in the store
+is skipped, a new file of the same issuer and period (corrected statements) replaces the old one
+'''
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from bfo import file_hash, process_bfo_files, add_panel_ratios, panel_index
+from profiling import timed, count
+
+manifest_columns = ['issuer', 'period', 'file_hash', 'rows', 'ingested']
+store_columns = ['issuer', 'period', 'file_hash', 'statement', 'code', 'line item', 'year', 'value']
+# Схема файлов хранилища, нужна для пустого набора данных, когда файлов нет
+store_schema = pa.schema([('issuer', pa.large_string()), ('period', pa.int64()), ('file_hash', pa.large_string()),
+                          ('statement', pa.large_string()), ('code', pa.int64()), ('line item', pa.large_string()),
+                          ('year', pa.int64()), ('value', pa.float64())])
+# По этим столбцам из нескольких отчетов одного эмитента выбирается последний (строки с одним названием различаются кодом)
+key_columns = ['issuer', 'statement', 'code', 'line item', 'year']
+
+# Блокировка файла между процессами: fcntl на linux и macos, msvcrt на windows
+try:
+    import fcntl
+
+    def _lock_file(f):
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f, fcntl.LOCK_UN)
+except ImportError:
+    import msvcrt
+
+    def _lock_file(f):
+        f.seek(0)
+        while True:
+            # LK_LOCK сдается через 10 секунд ожидания, тогда ждем дальше
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class StatementStore:
+    '''
+    Statements of the ingested БФО files in root: parts/<issuer>/<period>-<file hash>.parquet and manifest.parquet.
+    Safe to share between threads (streamlit sessions) and processes (bfo_batch.py --store):
+    changes of the manifest are made under a lock on the manifest.lock file
+    '''
+    def __init__(self, root):
+        self.root = root
+        self._manifest_path = os.path.join(root, 'manifest.parquet')
+        self._manifest = None
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._lock_path = os.path.join(root, 'manifest.lock')
+        os.makedirs(os.path.join(root, 'parts'), exist_ok=True)
+
+    def _part_path(self, issuer, period, file_hash):
+        # Название компании может содержать любые символы, поэтому папка называется по его хэшу
+        folder = hashlib.sha256(issuer.encode()).hexdigest()[:16]
+        return os.path.join(self.root, 'parts', folder, f'{period}-{file_hash}.parquet')
+
+    def manifest(self):
+        '''
+        DataFrame of the ingested files: issuer, period, file_hash, rows, ingested (unix time)
+        '''
+        # Хранилище может пополнить и другой процесс (bfo_batch.py --store), поэтому сверяем время изменения
+        mtime = os.stat(self._manifest_path).st_mtime_ns if os.path.exists(self._manifest_path) else None
+        if self._manifest is None or mtime != self._mtime:
+            self._manifest = pd.read_parquet(self._manifest_path) if mtime else pd.DataFrame(columns=manifest_columns)
+            self._mtime = mtime
+        return self._manifest
+
+    @contextmanager
+    def _locked(self):
+        '''
+        holds the lock of the store in this process and in the others, yields the manifest read from disk under it
+        '''
+        with self._lock, open(self._lock_path, 'a+b') as f:
+            _lock_file(f)
+            try:
+                # Время изменения может не отличаться при быстрых записях из разных процессов, поэтому перечитываем
+                self._mtime = None
+                yield self.manifest()
+            finally:
+                _unlock_file(f)
+
+    def _write_manifest(self, manifest):
+        # Пишем во временный файл и подменяем, чтобы читатели не увидели недописанный манифест
+        tmp = f'{self._manifest_path}.{os.getpid()}.tmp'
+        manifest.to_parquet(tmp, index=False)
+        os.replace(tmp, self._manifest_path)
+        self._manifest = manifest
+        self._mtime = os.stat(self._manifest_path).st_mtime_ns
+
+    def __len__(self):
+        return len(self.manifest())
+
+    def __contains__(self, key):
+        # key - (issuer, file hash)
+        manifest = self.manifest()
+        return bool(((manifest['issuer'] == key[0]) & (manifest['file_hash'] == key[1])).any())
+
+    def issuers(self):
+        return sorted(self.manifest()['issuer'].unique())
+
+    @timed('store: write')
+    def add(self, issuer, long, file_hash):
+        '''
+        writes the statements of one file (long DataFrame of statements_to_long) with their ratios to the store,
+        replaces the file of the same issuer and period if there is one, returns the period
+        '''
+        table = add_panel_ratios(long).reset_index().drop(columns='company')
+        period = int(table['year'].max())
+        table.insert(0, 'issuer', issuer)
+        table.insert(1, 'period', period)
+        table.insert(2, 'file_hash', file_hash)
+        path = self._part_path(issuer, period, file_hash)
+        with self._locked() as manifest:
+            replaced = manifest[(manifest['issuer'] == issuer) & (manifest['period'] == period)]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            table[store_columns].to_parquet(path, index=False)
+            row = pd.DataFrame([[issuer, period, file_hash, len(table), time.time()]], columns=manifest_columns)
+            self._write_manifest(pd.concat([manifest.drop(replaced.index), row], ignore_index=True))
+            for old in replaced.itertuples():
+                if old.file_hash != file_hash:
+                    os.remove(self._part_path(old.issuer, old.period, old.file_hash))
+        return period
+
+    def remove(self, issuers):
+        '''
+        deletes all the files of the issuers from the store
+        '''
+        with self._locked() as manifest:
+            removed = manifest[manifest['issuer'].isin(issuers)]
+            self._write_manifest(manifest.drop(removed.index).reset_index(drop=True))
+            for old in removed.itertuples():
+                os.remove(self._part_path(old.issuer, old.period, old.file_hash))
+
+    def ingest(self, files, max_workers=None):
+        '''
+        parses (in a process pool) and adds to the store the files that are not there yet,
+        files - iterable of (company, file) pairs like in process_bfo_files,
+        yields (company, status, error) for every file, status is 'added', 'skipped' (already in the store) or 'failed'
+        '''
+        manifest = self.manifest()
+        known = set(zip(manifest['issuer'], manifest['file_hash']))
+        # Сначала только хэшируем файлы: разбирать нужно лишь те, которых еще нет в хранилище
+        todo = []
+        for company, file in files:
+            try:
+                key = (company, file_hash(file))
+            except OSError as e:
+                yield company, 'failed', e
+                continue
+            if key in known:
+                count('store: skipped files')
+                yield company, 'skipped', None
+                continue
+            known.add(key)
+            todo.append((key, file))
+
+        # Номер файла в todo передается вместо названия компании, так результат находит свой хэш
+        for i, long, error in process_bfo_files(((i, file) for i, (_, file) in enumerate(todo)), max_workers):
+            company, digest = todo[i][0]
+            if error is None:
+                try:
+                    self.add(company, long, digest)
+                    count('store: added files')
+                except Exception as e:
+                    error = e
+            yield company, 'added' if error is None else 'failed', error
+
+    def dataset(self, issuers=None):
+        '''
+        lazy pyarrow dataset over the files of the issuers (all by default): nothing is read until
+        to_table or scanner is called, and then only the requested columns and matching row groups are read,
+        the issuers that are not in the store are ignored, without files the dataset is empty with store_schema
+        '''
+        manifest = self.manifest()
+        if issuers is not None:
+            manifest = manifest[manifest['issuer'].isin(issuers)]
+        paths = [self._part_path(issuer, period, digest) for issuer, period, digest
+                 in zip(manifest['issuer'], manifest['period'], manifest['file_hash'])]
+        if not paths:
+            return ds.dataset(store_schema.empty_table())
+        return ds.dataset(paths, format='parquet')
+
+    @timed('store: read')
+    def read(self, columns=None, issuers=None, statements=None, years=None, latest=True):
+        '''
+        reads the long table of the store: only the columns, issuers, statements and years asked for
+        (the filters are pushed down to parquet),
+        latest - if a year is in several files of the issuer, the values are taken from the newest one
+        '''
+        columns = list(columns or store_columns)
+        needed = columns + [col for col in key_columns + ['period'] if latest and col not in columns]
+        # Эмитенты, которых нет в хранилище, пропускаются: если не осталось ни одного, таблица пустая
+        manifest = self.manifest()
+        if issuers is not None:
+            manifest = manifest[manifest['issuer'].isin(issuers)]
+        if not len(manifest):
+            return pd.DataFrame(columns=columns)
+
+        condition = None
+        if statements is not None:
+            condition = ds.field('statement').isin(list(statements))
+        if years is not None:
+            by_year = ds.field('year').isin([int(year) for year in years])
+            condition = by_year if condition is None else condition & by_year
+        df = self.dataset(issuers).to_table(columns=needed, filter=condition).to_pandas()
+        if latest:
+            # Более поздний отчет содержит уточненные данные за прошлые годы
+            df = df.sort_values('period', kind='stable').drop_duplicates(key_columns, keep='last').sort_index()
+        return df[columns].reset_index(drop=True)
+
+    def panel(self, issuers=None, statements=None, years=None):
+        '''
+        long panel of the issuers with (company, year, code, line item) index and statement, value columns,
+        the same as build_panel returns, but read from the store
+        '''
+        df = self.read(['issuer', 'year', 'code', 'line item', 'statement', 'value'], issuers, statements, years)
+        return df.rename(columns={'issuer': 'company'}).set_index(panel_index)
@@ -0,0 +1,928 @@
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+
+def discount(t, r):
+    return pd.Series((1+r)**-np.asarray(t), index=t)
+
+def pv(flows, r):
+    discounts = discount(flows.index, r)
+    return (discounts * flows).sum()
+
+def inst_to_ann(r):
+    return np.expm1(r)
+
+def ann_to_inst(r):
+    return np.log1p(r)
+
+def bond_cash_flows(maturity=10, principal=1000, coupon_rate=0.03, coupons_per_year=12):
+    n_coupons = maturity*coupons_per_year
+    coupon_amt = principal*coupon_rate/coupons_per_year
+    coupon_times = np.arange(1, n_coupons+1)
+    cash_flows = pd.Series(data=coupon_amt, index=coupon_times)
+    cash_flows.iloc[-1] += principal
+    return cash_flows
+
+def bond_price(maturity=10, principal=1000, coupon_rate=0.03, coupons_per_year=12, discount_rate=0.03):
+    if isinstance(discount_rate, pd.DataFrame):
+        pricing_dates = discount_rate.index
+        prices = scenario_prices(maturity, principal, coupon_rate, coupons_per_year,
+                                 discount_rate.to_numpy(dtype=float), pricing_dates.to_numpy(dtype=float))
+        return pd.DataFrame(prices, index=pricing_dates, columns=discount_rate.columns)
+    else:
+        prices = price_bonds(maturity, principal, coupon_rate, coupons_per_year, discount_rate)[0]
+        return prices[0] if isinstance(discount_rate, YieldCurve) or np.ndim(discount_rate) == 0 else prices
+
+# Векторный расчет сразу для массивов облигаций и ставок
+def coupon_periods(maturity, coupons_per_year):
+    '''
+    Number of the coupons left to maturity and the shift of their periods (from -1 to 0): the coupons are counted
+    back from maturity, coupon k is paid at period k + shift, the last one exactly at maturity
+    Rounding errors of maturity * coupons_per_year (0.7 * 10 = 7.000000000000001) do not add a coupon
+    '''
+    periods = np.asarray(maturity, dtype=float) * coupons_per_year
+    n_coupons = np.maximum(np.ceil(periods - 1e-9), 0)
+    shift = np.where(n_coupons > 0, periods - n_coupons, 0.0)
+    return n_coupons, shift
+
+def cash_flow_schedule(maturity, principal=1000, coupon_rate=0.03, coupons_per_year=12):
+    '''
+    Padded cash flow schedule of many bonds at once (the arguments are scalars or arrays of the same length)
+    The coupons are counted back from maturity as in solve_ytm, so the first one can be less than a period away
+    Returns (periods, flows, n_coupons, shift): periods 1..max number of coupons, flows of shape (n_bonds, n_periods)
+    with zeros after the maturity of every bond, the number of coupons of every bond and the shift of its flows
+    in periods (from -1 to 0): the flows of a bond are paid at periods + shift
+    '''
+    maturity, principal, coupon_rate, coupons_per_year = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, dtype=float)) for x in (maturity, principal, coupon_rate, coupons_per_year)))
+    n_coupons, shift = coupon_periods(maturity, coupons_per_year)
+    n_coupons = n_coupons.astype(int)
+    periods = np.arange(1, n_coupons.max(initial=0) + 1)
+    flows = np.where(periods <= n_coupons[:, None], (principal * coupon_rate / coupons_per_year)[:, None], 0.0)
+    alive = n_coupons > 0
+    flows[alive, n_coupons[alive] - 1] += principal[alive]
+    return periods, flows, n_coupons, shift
+
+def discount_factors(periods, rates):
+    '''
+    (1+r)**-t for every rate per period (rows) and every period (columns)
+    '''
+    return (1 + np.asarray(rates, dtype=float)[:, None]) ** -np.asarray(periods, dtype=float)
+
+def price_bonds(maturity, principal=1000, coupon_rate=0.03, coupons_per_year=12, yields=0.03):
+    '''
+    Prices of many bonds at many annual yields in one call: returns array of shape (n_bonds, n_yields)
+    Discount factors are calculated once for every coupon frequency and shared by all the bonds with it,
+    so the price is one matrix product of the padded flows and the factors, scaled by (1+r)**-shift of every bond
+    yields can be a YieldCurve, then all the bonds are priced off it (n_yields = 1)
+    '''
+    curve = yields if isinstance(yields, YieldCurve) else None
+    if curve is None:
+        yields = np.atleast_1d(np.asarray(yields, dtype=float))
+    periods, flows, n_coupons, shift = cash_flow_schedule(maturity, principal, coupon_rate, coupons_per_year)
+    _, principal, coupon_rate, coupons_per_year = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, dtype=float)) for x in (maturity, principal, coupon_rate, coupons_per_year)))
+    prices = np.empty((len(flows), 1 if curve else len(yields)))
+    for freq in np.unique(coupons_per_year):
+        rows = coupons_per_year == freq
+        if curve:
+            times = (periods + shift[rows, None]) / freq
+            prices[rows] = (flows[rows] * curve.discount(times)).sum(axis=1, keepdims=True)
+        else:
+            prices[rows] = flows[rows] @ discount_factors(periods, yields / freq).T
+            prices[rows] *= discount_factors(shift[rows], yields / freq).T
+    # Погашенная облигация стоит номинал плюс последний купон
+    matured = n_coupons == 0
+    prices[matured] = (principal + principal * coupon_rate / coupons_per_year)[matured, None]
+    return prices
+
+def scenario_prices(maturity, principal, coupon_rate, coupons_per_year, rates, pricing_dates, chunk_size=4096, out=None):
+    '''
+    Prices of one bond along simulated rate paths: rates is (dates x scenarios) matrix of annual rates,
+    pricing_dates - number of coupon periods passed at every date (as in bond_price with DataFrame)
+    Every date has its own remaining number of coupons, so the closed-form price is broadcast over the whole matrix,
+    scenarios are processed by chunk_size columns, so rates and out can be np.memmap bigger than memory
+    Returns float64 (dates x scenarios) matrix (out if it is given)
+    '''
+    rates = np.asarray(rates)
+    n_dates, n_scenarios = rates.shape
+    if out is None:
+        out = np.empty((n_dates, n_scenarios))
+    remaining = maturity - np.asarray(pricing_dates, dtype=float) / coupons_per_year
+    # Купоны отсчитываются от даты погашения, как в cash_flow_schedule
+    n_coupons, shift = coupon_periods(remaining, coupons_per_year)
+    n_coupons, first = n_coupons[:, None], shift[:, None] + 1
+    coupon = principal * coupon_rate / coupons_per_year
+    matured = n_coupons == 0
+    for start in range(0, n_scenarios, chunk_size):
+        chunk = np.asarray(rates[:, start:start + chunk_size], dtype=float) / coupons_per_year
+        pv, _ = level_bond_pv(chunk, n_coupons, first, coupon, principal)
+        # Погашенная облигация стоит номинал плюс последний купон
+        out[:, start:start + chunk_size] = np.where(matured, principal + coupon, pv)
+    return out
+
+def bond_current_yield(principal=1000, current_price=1000, coupon_rate=0.2):
+    annual_coupon_payment = coupon_rate * principal
+    return annual_coupon_payment/current_price
+
+def bond_ytm_approx(maturity=10, principal=1000, current_price=950, coupon_rate=0.2):
+    """Приближенная формула, используется как начальная точка для solve_ytm"""
+    annual_coupon_payment = coupon_rate * principal
+    return (annual_coupon_payment+(principal-current_price)/maturity) / ((principal+current_price)/2)
+
+def bond_ytm(maturity=10, principal=1000, current_price=950, coupon_rate=0.2, coupons_per_year=1):
+    """Точная доходность к погашению (годовая, с капитализацией coupons_per_year раз в год)"""
+    return solve_ytm(current_price, maturity, principal, coupon_rate, coupons_per_year).ytm[0]
+
+YTMResult = namedtuple('YTMResult', ['ytm', 'converged', 'iterations', 'residual'])
+
+def level_bond_pv(rate, n_coupons, first, coupon, principal):
+    '''
+    Closed-form present value of bonds with level coupons and its derivative by the rate per period
+    coupons are paid at first, first+1, ..., first+n_coupons-1 periods, the principal with the last one
+    '''
+    log_v = -np.log1p(rate)
+    v_n = np.exp(n_coupons * log_v)
+    small = np.abs(rate) < 1e-8
+    safe = np.where(small, 1.0, rate)
+    # Сумма v + v^2 + ... + v^n и ее производная, при нулевой ставке - пределы
+    annuity = np.where(small, n_coupons, (1 - v_n) / safe)
+    d_annuity = np.where(small, -n_coupons * (n_coupons + 1) / 2,
+                         (n_coupons * v_n / (1 + safe) * safe - (1 - v_n)) / safe**2)
+    base = coupon * annuity + principal * v_n
+    d_base = coupon * d_annuity - principal * n_coupons * v_n / (1 + rate)
+    shift = np.exp((first - 1) * log_v)
+    pv = shift * base
+    dpv = shift * (d_base - (first - 1) / (1 + rate) * base)
+    return pv, dpv
+
+def solve_ytm(price, maturity, principal=1000, coupon_rate=0.03, coupons_per_year=12, clean=False, tol=1e-10, max_iter=100):
+    '''
+    Exact yield to maturity of many bonds at once (all the arguments are scalars or arrays of the same length)
+    The time to the next coupon can be a fraction of the period: the coupons are counted back from maturity
+    (the schedule of cash_flow_schedule, so bond_risk at the solved ytm returns the price)
+    price - dirty price by default, with clean=True the accrued interest is added to it
+    Newton steps are made for all the bonds together, if a step leaves the bracket [lo, hi] of the root
+    the bond is bisected instead, the bonds that have converged are not recalculated
+    Returns YTMResult(ytm, converged, iterations, residual) of arrays, ytm is annual with coupons_per_year compounding
+    '''
+    price, maturity, principal, coupon_rate, coupons_per_year = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, dtype=float)) for x in (price, maturity, principal, coupon_rate, coupons_per_year)))
+    n_coupons, shift = coupon_periods(maturity, coupons_per_year)
+    # Доля периода до ближайшего купона: последний купон выплачивается ровно в дату погашения
+    first = shift + 1
+    coupon = principal * coupon_rate / coupons_per_year
+    if clean:
+        price = price + coupon * (1 - first)
+    n = len(price)
+
+    # Начальная точка - приближенная формула, ставка считается за период
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = bond_ytm_approx(np.maximum(maturity, 1 / coupons_per_year), principal, price, coupon_rate) / coupons_per_year
+    lo = np.full(n, -0.99)
+    hi = np.full(n, 1.0)
+    rate = np.where(np.isfinite(rate), np.clip(rate, lo + 1e-6, hi - 1e-6), 0.0)
+
+    converged = np.zeros(n, dtype=bool)
+    iterations = np.zeros(n, dtype=int)
+    residual = np.full(n, np.nan)
+    active = (n_coupons > 0) & (price > 0)
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active & ~converged)
+        if idx.size == 0:
+            break
+        r = rate[idx]
+        pv, dpv = level_bond_pv(r, n_coupons[idx], first[idx], coupon[idx], principal[idx])
+        f = pv - price[idx]
+        residual[idx] = f
+        iterations[idx] += 1
+
+        # Цена убывает по ставке: если PV выше цены, корень правее r, иначе левее
+        above = f > 0
+        lo[idx] = np.where(above, r, lo[idx])
+        hi[idx] = np.where(above, hi[idx], r)
+        # Корень может быть правее начальной верхней границы, тогда расширяем ее
+        hi[idx] = np.where(above & (r >= hi[idx] * 0.999), hi[idx] * 2, hi[idx])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new = r - f / dpv
+        bisect = ~np.isfinite(new) | (new <= lo[idx]) | (new >= hi[idx])
+        new = np.where(bisect, (lo[idx] + hi[idx]) / 2, new)
+        exact = np.abs(f) <= tol * price[idx]
+        rate[idx] = np.where(exact, r, new)
+        converged[idx] = exact | (np.abs(new - r) <= tol)
+
+    ytm = np.where(active, rate * coupons_per_year, np.nan)
+    return YTMResult(ytm, converged, iterations, residual)
+
+# Кривая доходности
+def interpolate_zero_rates(tenors, rates, t):
+    """Линейная интерполяция бескупонных ставок, за пределами узлов ставка постоянна"""
+    return np.interp(t, tenors, rates)
+
+def interpolate_log_discounts(tenors, rates, t):
+    """Линейная интерполяция логарифма дисконт-фактора (постоянные форвардные ставки между узлами)"""
+    log_discounts = np.interp(t, np.r_[0.0, tenors], np.r_[0.0, -tenors * np.log1p(rates)])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inside = np.expm1(-log_discounts / t)
+    return np.where(t > tenors[-1], rates[-1], np.where(t > 0, inside, rates[0]))
+
+interpolations = {'linear': interpolate_zero_rates, 'log_linear': interpolate_log_discounts}
+
+class YieldCurve:
+    '''
+    Zero-coupon yield curve: annual zero rates (annual compounding, as in discount) at tenors in years
+    interpolation - name from interpolations or a function (tenors, rates, t) -> zero rates at t
+    Discount factors are interpolated for every call without a cache: the flows of bonds are counted back from
+    their maturities, so their tenors rarely repeat and a cache would only grow
+    '''
+    def __init__(self, tenors, rates, interpolation='linear'):
+        order = np.argsort(tenors)
+        self.tenors = np.asarray(tenors, dtype=float)[order]
+        self.rates = np.asarray(rates, dtype=float)[order]
+        self.interpolation = interpolations[interpolation] if isinstance(interpolation, str) else interpolation
+
+    @classmethod
+    def from_zero_rates(cls, zero_rates, interpolation='linear'):
+        """Кривая из Series бескупонных ставок с индексом сроков в годах"""
+        return cls(zero_rates.index, zero_rates.values, interpolation)
+
+    @classmethod
+    def bootstrap(cls, maturity, principal=1000, coupon_rate=0.03, coupons_per_year=12, price=1000,
+                  interpolation='linear', tol=1e-12, max_iter=200):
+        '''
+        Bootstraps the curve from quoted bonds (arrays of the same length): bonds are taken by maturity
+        and the zero rate at the maturity of every bond is found by bisection so that its price off the curve
+        equals the quote, the coupons before it are discounted at the rates found for the shorter bonds
+        Every bond gives its own node, so the maturities must be positive and different, otherwise ValueError
+        '''
+        maturity, principal, coupon_rate, coupons_per_year, price = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(x, dtype=float)) for x in (maturity, principal, coupon_rate, coupons_per_year, price)))
+        if (maturity <= 0).any():
+            raise ValueError(f'Bond maturities must be positive, got {maturity[maturity <= 0].tolist()}')
+        unique, counts = np.unique(maturity, return_counts=True)
+        if (counts > 1).any():
+            raise ValueError(f'Several bonds with the same maturity {unique[counts > 1].tolist()} give the same curve node')
+        interpolate = interpolations[interpolation] if isinstance(interpolation, str) else interpolation
+        tenors, rates = [], []
+        for i in np.argsort(maturity):
+            # Сроки потоков те же, что при оценке в price_bonds, узел кривой - дата погашения (срок последнего потока)
+            periods, flows, _, shift = cash_flow_schedule(maturity[i], principal[i], coupon_rate[i], coupons_per_year[i])
+            times = (periods + shift[0]) / coupons_per_year[i]
+            flows = flows[0]
+            lo, hi = -0.99, 10.0
+            for _ in range(max_iter):
+                rate = (lo + hi) / 2
+                curve_rates = interpolate(np.array(tenors + [times[-1]]), np.array(rates + [rate]), times)
+                value = flows @ (1 + curve_rates) ** -times
+                # Цена убывает по ставке
+                if value > price[i]:
+                    lo = rate
+                else:
+                    hi = rate
+                if hi - lo < tol:
+                    break
+            tenors.append(times[-1])
+            rates.append((lo + hi) / 2)
+        return cls(tenors, rates, interpolation)
+
+    def zero_rates(self, t):
+        return self.interpolation(self.tenors, self.rates, np.asarray(t, dtype=float))
+
+    def discount(self, t):
+        """Дисконт-факторы на сроки t (в годах), массив любой формы"""
+        t = np.asarray(t, dtype=float)
+        return np.exp(-t * np.log1p(self.zero_rates(t)))
+
+    def __repr__(self):
+        return f'YieldCurve({dict(zip(self.tenors.tolist(), self.rates.tolist()))})'
+
+def bond_total_return(monthly_prices, principal, coupon_rate, coupons_per_year, maturity=None):
+    # По умолчанию цены идут до самого погашения
+    maturity = (len(monthly_prices) - 1) / 12 if maturity is None else maturity
+    returns = total_returns(monthly_prices.to_numpy(dtype=float), maturity, principal, coupon_rate, coupons_per_year, cumulative=False)
+    return pd.DataFrame(returns.period_returns, index=monthly_prices.index[1:], columns=monthly_prices.columns)
+
+# Полная доходность многих облигаций
+TotalReturns = namedtuple('TotalReturns', ['period_returns', 'cumulative_returns', 'annualized_return', 'annualized_volatility', 'max_drawdown'])
+
+def coupon_schedule(n_steps, maturity, principal=1000, coupon_rate=0.03, coupons_per_year=12, steps_per_year=12):
+    '''
+    Coupons received by every bond (columns) at steps 1..n_steps, shape (n_steps, n_bonds)
+    maturity - years from step 0, the coupon dates are counted back from it as in cash_flow_schedule,
+    so they are the dates of the flows the prices are calculated with, a coupon between two steps is received at the later one
+    The parameters are scalars or arrays of the bonds
+    '''
+    maturity, principal, coupon_rate, coupons_per_year = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, dtype=float)) for x in (maturity, principal, coupon_rate, coupons_per_year)))
+    n_coupons, shift = coupon_periods(maturity, coupons_per_year)
+    # Число купонов, выплаченных к каждому шагу (купон k выплачивается в период k + shift), купон приходится на шаг, где оно увеличивается
+    periods = np.arange(n_steps + 1)[:, None] * coupons_per_year / steps_per_year
+    paid = np.clip(np.floor(periods - shift + 1e-9), 0, n_coupons)
+    return np.diff(paid, axis=0) * principal * coupon_rate / coupons_per_year
+
+def total_returns(prices, maturity, principal=1000, coupon_rate=0.03, coupons_per_year=12, steps_per_year=12, cumulative=True):
+    '''
+    Coupon-inclusive returns of many bonds: prices - array (n_steps+1, n_bonds) or (n_steps+1, n_bonds, n_scenarios)
+    without the coupon received at the step, maturity (years from the first price) and the other bond parameters
+    are scalars or arrays along the bond axis (see coupon_schedule)
+    The coupons are one (n_steps, n_bonds) matrix broadcast over the scenarios, the returns are calculated in place
+    Returns TotalReturns: period returns (n_steps, ...), cumulative returns and max drawdown (None with cumulative=False),
+    annualized return and volatility of every bond (and scenario)
+    '''
+    prices = np.asarray(prices, dtype=float)
+    n_steps = len(prices) - 1
+    coupons = coupon_schedule(n_steps, maturity, principal, coupon_rate, coupons_per_year, steps_per_year)
+    coupons = coupons.reshape(coupons.shape + (1,) * (prices.ndim - 2))
+
+    period_returns = prices[1:] + coupons
+    period_returns /= prices[:-1]
+    period_returns -= 1
+
+    log_growth = np.log1p(period_returns).sum(axis=0)
+    annualized_return = np.expm1(log_growth * steps_per_year / n_steps)
+    annualized_volatility = period_returns.std(axis=0, ddof=1) * np.sqrt(steps_per_year)
+
+    cumulative_returns = max_drawdown = None
+    if cumulative:
+        wealth = np.cumprod(1 + period_returns, axis=0)
+        peaks = np.maximum(np.maximum.accumulate(wealth, axis=0), 1)
+        max_drawdown = (wealth / peaks - 1).min(axis=0)
+        wealth -= 1
+        cumulative_returns = wealth
+    return TotalReturns(period_returns, cumulative_returns, annualized_return, annualized_volatility, max_drawdown)
+
+# Моделирование краткосрочной ставки методом Монте-Карло
+def short_rate_paths(model='vasicek', r0=0.1, a=0.5, b=0.1, sigma=0.02, n_years=10, steps_per_year=12,
+                     n_scenarios=1000, antithetic=False, seed=None, chunk_size=10000, annualize=True):
+    '''
+    Generates short rate paths of Vasicek (dr = a(b-r)dt + sigma dW) or CIR (dr = a(b-r)dt + sigma sqrt(r) dW) model
+    by chunks of chunk_size scenarios, so that all the paths never have to be in memory at once
+    The loop goes only over the time steps, every step is made for the whole chunk at once
+    antithetic - the second half of every chunk uses the same shocks with the opposite sign
+    annualize - convert instantaneous rates to annual ones (as bond_price expects)
+    Yields arrays of shape (n_steps+1, chunk), the result depends only on seed and chunk_size
+    '''
+    if model not in ('vasicek', 'cir'):
+        raise ValueError("model should be either 'vasicek' or 'cir'")
+    rng = np.random.default_rng(seed)
+    dt = 1 / steps_per_year
+    n_steps = int(round(n_years * steps_per_year))
+    # Для Васичека используем точную дискретизацию
+    decay = np.exp(-a * dt)
+    vasicek_vol = sigma * np.sqrt((1 - decay**2) / (2 * a)) if a > 0 else sigma * np.sqrt(dt)
+
+    for start in range(0, n_scenarios, chunk_size):
+        size = min(chunk_size, n_scenarios - start)
+        shocks = rng.standard_normal((n_steps, (size + 1) // 2 if antithetic else size))
+        if antithetic:
+            shocks = np.concatenate([shocks, -shocks], axis=1)[:, :size]
+        rates = np.empty((n_steps + 1, size))
+        rates[0] = r0
+        for t in range(n_steps):
+            r = rates[t]
+            if model == 'vasicek':
+                rates[t + 1] = r * decay + b * (1 - decay) + vasicek_vol * shocks[t]
+            else:
+                # Схема Эйлера с обрезанием отрицательных ставок
+                rates[t + 1] = np.maximum(r + a * (b - r) * dt + sigma * np.sqrt(r * dt) * shocks[t], 0)
+        yield inst_to_ann(rates) if annualize else rates
+
+def simulate_short_rates(model='vasicek', r0=0.1, a=0.5, b=0.1, sigma=0.02, n_years=10, steps_per_year=12,
+                         n_scenarios=1000, antithetic=False, seed=None, annualize=True):
+    '''
+    All the paths of short_rate_paths in one DataFrame (steps x scenarios) that can be passed to bond_price
+    '''
+    chunks = short_rate_paths(model, r0, a, b, sigma, n_years, steps_per_year, n_scenarios, antithetic, seed, annualize=annualize)
+    return pd.DataFrame(np.concatenate(list(chunks), axis=1))
+
+def scenario_returns(maturity, principal, coupon_rate, coupons_per_year, rates, cumulative=False):
+    '''
+    Prices of one bond along monthly rate paths (months x scenarios matrix of annual rates, as from short_rate_paths)
+    and its coupon-inclusive returns, the coupons are received by the same schedule from maturity as in the prices
+    Returns (prices, TotalReturns)
+    '''
+    months = np.arange(len(rates))
+    prices = scenario_prices(maturity, principal, coupon_rate, coupons_per_year, rates, months * coupons_per_year / 12)
+    # Последний купон приходит из графика купонов, поэтому погашенная облигация стоит только номинал
+    matured = (coupon_periods(maturity - months / 12, coupons_per_year)[0] == 0)[:, None]
+    returns = total_returns(np.where(matured, principal, prices), maturity, principal, coupon_rate, coupons_per_year,
+                            cumulative=cumulative)
+    return prices, returns
+
+def simulate_bond(maturity=10, principal=1000, coupon_rate=0.03, coupons_per_year=12, n_scenarios=1000, chunk_size=10000,
+                  fan_paths=2000, percentiles=(5, 25, 50, 75, 95), **model):
+    '''
+    Simulates monthly rate paths (model parameters are passed to short_rate_paths), prices the bond along them
+    and calculates its total return by chunks of scenarios
+    Returns (rates_fan, prices_fan, returns): percentiles of the rates and prices at every month over the first fan_paths
+    scenarios and DataFrame with the total and annualized return of every scenario
+    '''
+    model['steps_per_year'] = 12
+    rate_samples, price_samples, returns = [], [], []
+    for rates in short_rate_paths(n_scenarios=n_scenarios, chunk_size=chunk_size, **model):
+        prices, result = scenario_returns(maturity, principal, coupon_rate, coupons_per_year, rates)
+        returns.append(np.expm1(np.log1p(result.period_returns).sum(axis=0)))
+
+        # Для веерных графиков храним только первые fan_paths сценариев
+        kept = sum(sample.shape[1] for sample in rate_samples)
+        if kept < fan_paths:
+            rate_samples.append(rates[:, :fan_paths - kept])
+            price_samples.append(prices[:, :fan_paths - kept])
+
+    columns = [f'{q}%' for q in percentiles]
+    rates_fan = pd.DataFrame(np.percentile(np.concatenate(rate_samples, axis=1), percentiles, axis=1).T, columns=columns)
+    prices_fan = pd.DataFrame(np.percentile(np.concatenate(price_samples, axis=1), percentiles, axis=1).T, columns=columns)
+    total = np.concatenate(returns)
+    n_months = len(rates_fan) - 1
+    returns = pd.DataFrame({'Total Return': total, 'Annualized Return': (1 + total) ** (12 / n_months) - 1})
+    return rates_fan, prices_fan, returns
+
+def macaulay_duration(flows, discount_rate, coupons_per_year=12):
+    '''
+    Duration of the flows (Series indexed by coupon periods), for DataFrame - duration of every column
+    '''
+    t = flows.index.to_numpy(dtype=float)
+    if isinstance(discount_rate, YieldCurve):
+        discounts = discount_rate.discount(t / coupons_per_year)
+    else:
+        discounts = (1 + discount_rate) ** -t
+    if flows.ndim == 2:
+        t, discounts = t[:, None], discounts[:, None]
+    discounted_flows = flows.to_numpy(dtype=float) * discounts
+    return (t * discounted_flows).sum(axis=0) / discounted_flows.sum(axis=0) / coupons_per_year
+
+RiskMetrics = namedtuple('RiskMetrics', ['price', 'macaulay_duration', 'modified_duration', 'convexity', 'dv01', 'key_rate_durations'])
+
+def key_rate_weights(times, key_rates):
+    '''
+    Triangular weights of the times (in years) between the neighbouring key rates (in years),
+    before the first and after the last key rate the whole weight goes to it, so the weights of every time sum to 1
+    '''
+    key_rates = np.asarray(key_rates, dtype=float)
+    times = np.clip(np.asarray(times, dtype=float), key_rates[0], key_rates[-1])
+    eye = np.eye(len(key_rates))
+    return np.stack([np.interp(times, key_rates, eye[j]) for j in range(len(key_rates))], axis=-1)
+
+def key_rate_sums(values, times, key_rates):
+    '''
+    Sums of the values (n_bonds, n_periods) of every bond distributed by key_rate_weights of their times (n_bonds, n_periods),
+    the same as values @ key_rate_weights for shared times, but every time only goes to its two neighbouring key rates
+    Returns (n_bonds, n_key_rates)
+    '''
+    key_rates = np.asarray(key_rates, dtype=float)
+    n_bonds, n_keys = len(values), len(key_rates)
+    if n_keys == 1:
+        return values.sum(axis=1, keepdims=True)
+    times = np.clip(times, key_rates[0], key_rates[-1])
+    left = np.clip(np.searchsorted(key_rates, times, side='right') - 1, 0, n_keys - 2)
+    right_weight = (times - key_rates[left]) / (key_rates[left + 1] - key_rates[left])
+    bins = left + n_keys * np.arange(n_bonds)[:, None]
+    sums = np.bincount(bins.ravel(), (values * (1 - right_weight)).ravel(), minlength=n_bonds * n_keys)
+    sums[1:] += np.bincount(bins.ravel(), (values * right_weight).ravel(), minlength=n_bonds * n_keys)[:-1]
+    return sums.reshape(n_bonds, n_keys)
+
+def risk_from_discounts(periods, flows, discounts, rate, coupons_per_year, key_rates=None, compounding=None):
+    '''
+    Price and risk metrics of the bonds from the discount factors that were already calculated for pricing
+    periods - coupon periods (n_periods,) shared by the bonds or of every bond (n_bonds, n_periods),
+    flows and discounts - (n_bonds, n_periods)
+    rate - rate per compounding period of every bond (n_bonds,) or of every flow (n_bonds, n_periods),
+    compounding - compounding periods per year (coupons_per_year by default, 1 for zero rates of a YieldCurve)
+    All the metrics are weighted sums of the same discounted flows, durations are in years
+    Matured bonds have no flows left: their price and DV01 are 0, durations and convexity are NaN
+    '''
+    coupons_per_year = np.broadcast_to(np.asarray(coupons_per_year, dtype=float), len(flows))
+    compounding = coupons_per_year if compounding is None else np.broadcast_to(np.asarray(compounding, dtype=float), len(flows))
+    rate = np.asarray(rate, dtype=float)
+    growth = 1 + (rate if rate.ndim == 2 else rate[:, None])
+    times = periods / coupons_per_year[:, None]
+
+    discounted = flows * discounts
+    price = discounted.sum(axis=1)
+    sensitivity = discounted * times / growth
+    # У погашенных облигаций цена 0, их метрики NaN без предупреждений о делении на ноль
+    with np.errstate(divide='ignore', invalid='ignore'):
+        macaulay = (discounted * times).sum(axis=1) / price
+        modified = sensitivity.sum(axis=1) / price
+        convexity = (sensitivity * (times + 1 / compounding[:, None]) / growth).sum(axis=1) / price
+    dv01 = sensitivity.sum(axis=1) * 1e-4
+
+    key_rate_durations = None
+    if key_rates is not None:
+        # Чувствительность к сдвигу ставки в окрестности каждого ключевого срока, их сумма равна модифицированной дюрации
+        key_rate_durations = np.empty((len(price), len(key_rates)))
+        if np.ndim(periods) == 2:
+            # Свои сроки у каждой облигации
+            key_rate_durations[:] = key_rate_sums(sensitivity, times, key_rates)
+        else:
+            for freq in np.unique(coupons_per_year):
+                rows = coupons_per_year == freq
+                key_rate_durations[rows] = sensitivity[rows] @ key_rate_weights(periods / freq, key_rates)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            key_rate_durations /= price[:, None]
+    return RiskMetrics(price, macaulay, modified, convexity, dv01, key_rate_durations)
+
+def bond_risk(maturity, principal=1000, coupon_rate=0.03, coupons_per_year=12, yields=0.03, key_rates=None):
+    '''
+    Price, Macaulay and modified duration, convexity, DV01 and key rate durations (if key_rates are given, in years)
+    of many bonds at once, every bond at its own annual yield (scalars or arrays of the same length)
+    yields can be a YieldCurve, then the durations are measured against parallel shifts of its zero rates
+    The discount factors are calculated once and shared by all the metrics
+    Durations, convexity and key rate durations of matured bonds (maturity 0) are NaN
+    '''
+    periods, flows, n_coupons, shift = cash_flow_schedule(maturity, principal, coupon_rate, coupons_per_year)
+    # Без дробных периодов сроки общие для всех облигаций
+    periods = periods + shift[:, None] if shift.any() else periods.astype(float)
+    if isinstance(yields, YieldCurve):
+        coupons_per_year = np.broadcast_to(np.asarray(coupons_per_year, dtype=float), len(flows))
+        times = periods / coupons_per_year[:, None]
+        return risk_from_discounts(periods, flows, yields.discount(times), yields.zero_rates(times),
+                                   coupons_per_year, key_rates, compounding=1)
+    yields = np.broadcast_to(np.asarray(yields, dtype=float), len(flows))
+    coupons_per_year = np.broadcast_to(np.asarray(coupons_per_year, dtype=float), len(flows))
+    rate = yields / coupons_per_year
+    discounts = np.exp(-np.log1p(rate)[:, None] * periods)
+    return risk_from_discounts(periods, flows, discounts, rate, coupons_per_year, key_rates)
+
+def match_durations(cf_t, cf_s, cf_l, discount_rate):
+    d_t, d_s, d_l = macaulay_duration(pd.concat([cf_t, cf_s, cf_l], axis=1).fillna(0), discount_rate)
+    return (d_l - d_t)/(d_l - d_s)
+
+# Иммунизация портфеля обязательств
+ImmunizationResult = namedtuple('ImmunizationResult', ['units', 'values', 'assets', 'liabilities', 'mismatch', 'cash_flow_mismatch'])
+
+def _nnls(A, b, tol=1e-12, max_iter=None):
+    '''
+    Non-negative least squares min ||Ax - b|| subject to x >= 0 (Lawson-Hanson active set method)
+    The number of rows is small, so every step is one pass over the columns and lstsq on the chosen ones
+    '''
+    n = A.shape[1]
+    # Порог не ниже ошибки округления, иначе обнуленный столбец снова выбирается до max_iter
+    tol = max(tol, 10 * np.finfo(float).eps * np.abs(A).sum(axis=0).max() * max(A.shape))
+    x = np.zeros(n)
+    passive = np.zeros(n, dtype=bool)
+    gradient = A.T @ b
+    for _ in range(max_iter or 3 * n):
+        candidates = np.where(passive, -np.inf, gradient)
+        j = np.argmax(candidates)
+        if candidates[j] <= tol:
+            break
+        passive[j] = True
+        while True:
+            z = np.zeros(n)
+            z[passive] = np.linalg.lstsq(A[:, passive], b, rcond=None)[0]
+            if (z[passive] > tol).all():
+                break
+            # Возвращаемся по отрезку x -> z до первой обнулившейся переменной и убираем ее из набора
+            negative = passive & (z <= tol)
+            alpha = np.min(x[negative] / (x[negative] - z[negative]))
+            x += alpha * (z - x)
+            passive &= x > tol
+            x[~passive] = 0
+        x = z
+        gradient = A.T @ (b - A @ x)
+    return x
+
+def immunize(liability_times, liability_amounts, maturity, principal=1000, coupon_rate=0.03, coupons_per_year=12,
+             discount_rate=0.03, budget=None, match_convexity=True, match_cash_flows=False, hard_weight=100.0):
+    '''
+    Long-only portfolio of the candidate bonds (arrays of the same length) that immunizes the liabilities
+    (amounts paid at times in years): its value equals budget (PV of the liabilities by default),
+    its modified duration equals the duration of the liabilities and its convexity is not lower than theirs
+    (if match_convexity), with match_cash_flows the discounted flows are also matched by the liability dates
+    Everything is valued off one curve (discount_rate is a YieldCurve or a flat annual rate), so the durations
+    of the bonds and the liabilities are measured against the same parallel shift of the zero rates
+    The conditions are rows of one non-negative least squares problem of the weights (values / PV of the liabilities):
+    the weights sum to budget / PV, and the value-weighted duration and convexity minus those of the liabilities is zero,
+    so the durations are matched for any budget. Without match_cash_flows they hold exactly when it is feasible,
+    with it the budget, duration and convexity rows are only weighted by hard_weight against the cash flow rows,
+    so they hold approximately. The residual mismatch is reported
+    Returns ImmunizationResult: units and values of every bond, metrics of the assets and the liabilities,
+    mismatch of value, duration and convexity and mismatch of the discounted flows by the liability dates
+    '''
+    curve = discount_rate if isinstance(discount_rate, YieldCurve) else YieldCurve([1.0], [discount_rate])
+    liability_times = np.asarray(liability_times, dtype=float)
+    liability_amounts = np.asarray(liability_amounts, dtype=float)
+    liabilities = risk_from_discounts(liability_times, liability_amounts[None], curve.discount(liability_times)[None],
+                                      curve.zero_rates(liability_times)[None], 1, compounding=1)
+    liability_pv = liabilities.price[0]
+    budget = liability_pv if budget is None else budget
+
+    # Метрики кандидатов на единицу стоимости
+    periods, flows, _, shift = cash_flow_schedule(maturity, principal, coupon_rate, coupons_per_year)
+    periods = periods + shift[:, None]
+    coupons_per_year = np.broadcast_to(np.asarray(coupons_per_year, dtype=float), len(flows))
+    times = periods / coupons_per_year[:, None]
+    discounts = curve.discount(times)
+    risk = risk_from_discounts(periods, flows, discounts, curve.zero_rates(times), coupons_per_year, compounding=1)
+
+    # Дюрация и выпуклость портфеля - средние по стоимости, поэтому строки записаны как отклонения от обязательств
+    rows = [np.ones(len(flows)), risk.modified_duration / liabilities.modified_duration[0] - 1]
+    targets = [budget / liability_pv, 0.0]
+    if match_convexity:
+        rows.append(risk.convexity / liabilities.convexity[0] - 1)
+        targets.append(0.0)
+    A = hard_weight * np.array(rows)
+    b = hard_weight * np.array(targets)
+    if match_convexity:
+        # Избыточная выпуклость допустима: переменная-остаток с коэффициентом -1 в строке выпуклости
+        slack = np.zeros((len(A), 1))
+        slack[-1] = -hard_weight
+        A = np.hstack([A, slack])
+
+    if match_cash_flows:
+        # Дисконтированные потоки облигаций распределяются по датам обязательств как в ключевых ставках
+        buckets = key_rate_sums(flows * discounts, times, liability_times)
+        liability_buckets = liability_amounts * curve.discount(liability_times)
+        cash_flow_rows = (buckets / risk.price[:, None]).T
+        if match_convexity:
+            cash_flow_rows = np.hstack([cash_flow_rows, np.zeros((len(cash_flow_rows), 1))])
+        A = np.vstack([A, cash_flow_rows])
+        b = np.concatenate([b, liability_buckets / liability_pv])
+
+    weights = _nnls(A, b)[:len(flows)]
+    values = weights * liability_pv
+    units = values / risk.price
+    asset_value = values.sum()
+    assets = {
+        'Value': asset_value,
+        'Modified Duration': values @ risk.modified_duration / asset_value if asset_value else np.nan,
+        'Convexity': values @ risk.convexity / asset_value if asset_value else np.nan,
+    }
+    liability_metrics = {
+        'Value': liability_pv,
+        'Modified Duration': liabilities.modified_duration[0],
+        'Convexity': liabilities.convexity[0],
+    }
+    mismatch = {
+        'Value': asset_value - budget,
+        'Modified Duration': assets['Modified Duration'] - liability_metrics['Modified Duration'],
+        'Convexity': assets['Convexity'] - liability_metrics['Convexity'],
+    }
+    cash_flow_mismatch = None
+    if match_cash_flows:
+        cash_flow_mismatch = pd.Series(units @ buckets - liability_buckets, index=liability_times)
+    return ImmunizationResult(units, values, assets, liability_metrics, mismatch, cash_flow_mismatch)
+
+def bond_summary(name='Облигация', principal=1000, maturity=10, current_price=1000, coupon_rate=0.03, coupons_per_year=12, discount_rate=0.03):
+    market_price = bond_price(maturity, principal, coupon_rate, coupons_per_year, discount_rate)
+    current_yield = bond_current_yield(principal, current_price, coupon_rate)
+    ytm = bond_ytm(maturity, principal, current_price, coupon_rate, coupons_per_year)
+    risk = bond_risk(maturity, principal, coupon_rate, coupons_per_year, ytm)
+    return pd.DataFrame({
+        "Market Price": market_price,
+        "Current Yield": current_yield,
+        "YTM": ytm,
+        "Macaulay Duration": risk.macaulay_duration[0],
+        "Modified Duration": risk.modified_duration[0],
+        "Convexity": risk.convexity[0],
+        "DV01": risk.dv01[0]
+    }, index = [name])
+
+def bond_summaries(names, principal, maturity, current_price, coupon_rate, coupons_per_year, discount_rate):
+    '''
+    bond_summary of many bonds at once (the arguments are arrays of the same length or scalars),
+    discount_rate - rate of every bond or one YieldCurve for all of them
+    '''
+    if isinstance(discount_rate, YieldCurve):
+        market_price = price_bonds(maturity, principal, coupon_rate, coupons_per_year, discount_rate)[:, 0]
+    else:
+        market_price = bond_risk(maturity, principal, coupon_rate, coupons_per_year, discount_rate).price
+    ytm = solve_ytm(current_price, maturity, principal, coupon_rate, coupons_per_year).ytm
+    risk = bond_risk(maturity, principal, coupon_rate, coupons_per_year, ytm)
+    return pd.DataFrame({
+        "Market Price": market_price,
+        "Current Yield": bond_current_yield(np.asarray(principal, dtype=float), np.asarray(current_price, dtype=float), coupon_rate),
+        "YTM": ytm,
+        "Macaulay Duration": risk.macaulay_duration,
+        "Modified Duration": risk.modified_duration,
+        "Convexity": risk.convexity,
+        "DV01": risk.dv01
+    }, index=pd.Index(names))
+
+# Импорт портфеля из файла
+holdings_columns = {
+    'Название': 'name',
+    'Номинал': 'principal',
+    'Срок до погашения': 'maturity',
+    'Текущая цена': 'current_price',
+    'Купонная ставка': 'coupon_rate',
+    'Число выплат в год': 'coupons_per_year',
+    'Дисконтная ставка': 'discount_rate',
+}
+
+def read_holdings(file, chunk_size=500):
+    '''
+    Reads a CSV or XLSX holdings file by chunks of chunk_size rows, the columns are renamed by holdings_columns
+    (the parameter names of bond_summary are accepted as they are). Yields DataFrames indexed by the line number in the file
+    '''
+    name = getattr(file, 'name', file)
+    if str(name).lower().endswith(('.xlsx', '.xlsm')):
+        from openpyxl import load_workbook
+        rows = load_workbook(file, read_only=True, data_only=True).active.iter_rows(values_only=True)
+        header = [str(h).strip() for h in next(rows, ())]
+        chunks = (pd.DataFrame(chunk, columns=header) for chunk in _batched(rows, chunk_size))
+    else:
+        chunks = pd.read_csv(file, sep=None, engine='python', encoding='utf-8-sig', chunksize=chunk_size)
+    line = 2
+    for chunk in chunks:
+        chunk = chunk.rename(columns=lambda c: holdings_columns.get(str(c).strip(), str(c).strip()))
+        chunk.index = pd.RangeIndex(line, line + len(chunk), name='Строка')
+        line += len(chunk)
+        yield chunk
+
+def _batched(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def validate_holdings(chunk, **defaults):
+    '''
+    Checks every row of the chunk at once, the missing columns are taken from defaults (e.g. discount_rate)
+    or raise ValueError,
+    if discount_rate is a YieldCurve, it is used for all the rows and the column is not checked
+    Returns (valid rows with numeric parameters, DataFrame of errors with one message per invalid row)
+    '''
+    curve = isinstance(defaults.get('discount_rate'), YieldCurve)
+    if curve:
+        defaults = {column: value for column, value in defaults.items() if column != 'discount_rate'}
+    chunk = chunk.copy()
+    for column, value in defaults.items():
+        if column not in chunk:
+            chunk[column] = value
+    if 'name' not in chunk:
+        chunk['name'] = [f'Облигация {line}' for line in chunk.index]
+    chunk['name'] = chunk['name'].fillna(pd.Series([f'Облигация {line}' for line in chunk.index], index=chunk.index)).astype(str)
+
+    rules = {
+        'principal': lambda x: x > 0,
+        'maturity': lambda x: x > 0,
+        'current_price': lambda x: x > 0,
+        'coupon_rate': lambda x: x >= 0,
+        'coupons_per_year': lambda x: (x > 0) & (x == np.round(x)),
+        'discount_rate': lambda x: x > -1,
+    }
+    if curve:
+        del rules['discount_rate']
+    missing = [column for column in rules if column not in chunk]
+    if missing:
+        names = {column: name for name, column in holdings_columns.items()}
+        raise ValueError('В файле нет столбцов: ' + ', '.join(f'{names[column]} ({column})' for column in missing))
+    messages = pd.Series('', index=chunk.index)
+    for column, rule in rules.items():
+        values = chunk[column]
+        # Текст (object или StringDtype в pandas 3): убираем пробелы и десятичную запятую
+        if not pd.api.types.is_numeric_dtype(values):
+            values = values.astype(str).str.replace('\xa0', '').str.replace(' ', '').str.replace(',', '.')
+        values = pd.to_numeric(values, errors='coerce')
+        chunk[column] = values
+        messages[values.isna()] += f'{column}: не число; '
+        messages[values.notna() & ~rule(values)] += f'{column}: недопустимое значение; '
+    invalid = messages != ''
+    errors = pd.DataFrame({'Название': chunk.loc[invalid, 'name'], 'Ошибка': messages[invalid].str.rstrip('; ')})
+    return chunk[~invalid], errors
+
+def value_holdings(file, chunk_size=500, **defaults):
+    '''
+    Reads, validates and values the holdings file by chunks
+    Yields (summaries of the valid rows, errors, number of rows read so far) after every chunk
+    '''
+    curve = defaults.get('discount_rate') if isinstance(defaults.get('discount_rate'), YieldCurve) else None
+    rows_read = 0
+    for chunk in read_holdings(file, chunk_size):
+        rows_read += len(chunk)
+        valid, errors = validate_holdings(chunk, **defaults)
+        if valid.empty:
+            yield bond_summaries([], [], [], [], [], [], []), errors, rows_read
+            continue
+        summaries = bond_summaries(valid['name'], valid['principal'].to_numpy(), valid['maturity'].to_numpy(),
+                                   valid['current_price'].to_numpy(), valid['coupon_rate'].to_numpy(),
+                                   valid['coupons_per_year'].to_numpy(),
+                                   curve if curve else valid['discount_rate'].to_numpy())
+        yield summaries, errors, rows_read
+
+# Портфель облигаций
+class BondPortfolio:
+    '''
+    Portfolio of bond_summary rows stored in preallocated column arrays that grow by doubling.
+    Every bond gets a stable id that does not change when other bonds are removed, so equal names do not collide,
+    the rows of removed bonds are reused. Market value and the sums for the value-weighted YTM and durations
+    are updated on every add and remove, so nothing is recalculated over the whole portfolio.
+    A NaN metric (e.g. YTM of a matured bond) is left out of its average, but not out of the others
+    '''
+    columns = ['Market Price', 'Current Yield', 'YTM', 'Macaulay Duration', 'Modified Duration', 'Convexity', 'DV01']
+    weighted = ['YTM', 'Macaulay Duration', 'Modified Duration']
+
+    def __init__(self, capacity=64):
+        self.ids = np.full(capacity, -1)
+        self.names = np.empty(capacity, dtype=object)
+        self.values = {column: np.full(capacity, np.nan) for column in self.columns}
+        self.next_id = 0
+        self._rows = {}
+        self._free = list(range(capacity - 1, -1, -1))
+        self._sums = dict.fromkeys(['Market Value'] + self.weighted, 0.0)
+        # Стоимость облигаций, у которых метрика столбца известна, и их число
+        self._weights = dict.fromkeys(self.weighted, 0.0)
+        self._known = dict.fromkeys(['Market Value'] + self.weighted, 0)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _grow(self, capacity):
+        old = len(self.ids)
+        self.ids = np.concatenate([self.ids, np.full(capacity - old, -1)])
+        self.names = np.concatenate([self.names, np.empty(capacity - old, dtype=object)])
+        for column in self.columns:
+            self.values[column] = np.concatenate([self.values[column], np.full(capacity - old, np.nan)])
+        self._free = list(range(capacity - 1, old - 1, -1)) + self._free
+
+    def _update_sums(self, rows, sign):
+        market_value = self.values['Market Price'][rows]
+        priced = np.isfinite(market_value)
+        market_value = np.where(priced, market_value, 0.0)
+        self._sums['Market Value'] += sign * market_value.sum()
+        self._known['Market Value'] += sign * int(priced.sum())
+        for column in self.weighted:
+            values = self.values[column][rows]
+            known = np.isfinite(values)
+            self._sums[column] += sign * (market_value[known] * values[known]).sum()
+            self._weights[column] += sign * market_value[known].sum()
+            self._known[column] += sign * int(known.sum())
+        # После удаления всех облигаций с известной метрикой в суммах остается только ошибка округления
+        for column, count in self._known.items():
+            if not count:
+                self._sums[column] = 0.0
+                if column in self._weights:
+                    self._weights[column] = 0.0
+
+    def add(self, names, table):
+        '''
+        Adds bonds: names - one name or a list, table - DataFrame (or dict) with the columns of bond_summary
+        Returns ids of the added bonds
+        '''
+        names = [names] if isinstance(names, str) else list(names)
+        if len(self._free) < len(names):
+            self._grow(max(2 * len(self.ids), len(self._rows) + len(names)))
+        rows = np.array([self._free.pop() for _ in names], dtype=int)
+        ids = np.arange(self.next_id, self.next_id + len(names))
+        self.next_id += len(names)
+        self.ids[rows] = ids
+        self.names[rows] = names
+        for column in self.columns:
+            self.values[column][rows] = np.asarray(table[column], dtype=float)
+        self._rows.update(zip(ids.tolist(), rows.tolist()))
+        self._update_sums(rows, 1)
+        return ids
+
+    def remove(self, ids):
+        rows = np.array([self._rows.pop(i) for i in np.atleast_1d(ids).tolist() if i in self._rows], dtype=int)
+        if rows.size:
+            self._update_sums(rows, -1)
+            self.ids[rows] = -1
+            self.names[rows] = None
+            for column in self.columns:
+                self.values[column][rows] = np.nan
+            self._free.extend(rows.tolist())
+
+    def clear(self):
+        self.__init__(len(self.ids))
+
+    def aggregates(self):
+        """Рыночная стоимость и средневзвешенные по ней YTM и дюрации"""
+        result = {'Market Value': self._sums['Market Value']}
+        for column in self.weighted:
+            weight = self._weights[column]
+            result[column] = self._sums[column] / weight if weight else np.nan
+        return result
+
+    def frame(self):
+        # Словарь id -> строка заполняется по возрастанию id, поэтому облигации идут в порядке добавления
+        rows = np.fromiter(self._rows.values(), dtype=int, count=len(self._rows))
+        df = pd.DataFrame({column: self.values[column][rows] for column in self.columns}, index=pd.Index(self.ids[rows], name='id'))
+        df.insert(0, 'Name', self.names[rows])
+        return df
+
+    def save(self, file):
+        """Сохраняет портфель в .npz (file - путь или файловый объект)"""
+        df = self.frame()
+        np.savez_compressed(file, ids=df.index.to_numpy(), names=df['Name'].to_numpy(dtype=str), next_id=self.next_id,
+                            **{column: df[column].to_numpy() for column in self.columns})
+
+    @classmethod
+    def load(cls, file):
+        data = np.load(file, allow_pickle=False)
+        portfolio = cls(max(64, len(data['ids'])))
+        if len(data['ids']):
+            ids = portfolio.add(data['names'].tolist(), {column: data[column] for column in cls.columns})
+            # Восстанавливаем сохраненные id
+            rows = [portfolio._rows[i] for i in ids.tolist()]
+            portfolio.ids[rows] = data['ids']
+            portfolio._rows = dict(zip(data['ids'].tolist(), rows))
+        portfolio.next_id = int(data['next_id'])
+        return portfolio
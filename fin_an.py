@@ -1,8 +1,17 @@
 import pandas as pd
 import numpy as np
 import urllib.request, urllib.parse, urllib.error
-from bs4 import BeautifulSoup
+import http.client
+import gzip
+from bs4 import BeautifulSoup, SoupStrainer
 import ssl
+import os
+import time
+import threading
+import contextvars
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from profiling import timed, count
 ctx = ssl.create_default_context()
 ctx.check_hostname = False
 ctx.verify_mode = ssl.CERT_NONE
@@ -13,15 +22,270 @@ headers = {
                   'Chrome/91.0.4472.124 Safari/537.36'
 }
 
+base_url = 'https://smart-lab.ru'
+
+# lxml разбирает страницы в несколько раз быстрее встроенного html.parser, но он необязателен
+html_parser = 'lxml' if importlib.util.find_spec('lxml') is not None else 'html.parser'
+
+# Соединения с сайтом переиспользуются (keep-alive), одновременно к одному хосту открыто не больше
+# max_connections_per_host запросов, на 429 и 5xx ответы повторяем запрос с экспоненциальной задержкой
+max_connections_per_host = 4
+retries = 3
+backoff = 0.5
+timeout = 30
+_connections = threading.local()
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+# Кэш страниц smart-lab на диске: страница считается свежей cache_ttl секунд,
+# в режиме offline сеть не используется совсем (например, для тестов на сохраненных страницах)
+cache_dir = os.environ.get('SMARTLAB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'smartlab'))
+cache_ttl = float(os.environ.get('SMARTLAB_CACHE_TTL', 7 * 24 * 3600))
+# Страницы старше cache_max_age удаляются из кэша (один раз за процесс, при первой загрузке из сети)
+cache_max_age = float(os.environ.get('SMARTLAB_CACHE_MAX_AGE', 90 * 24 * 3600))
+_pruned = False
+offline = os.environ.get('SMARTLAB_OFFLINE', '') == '1'
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
 IS_statements = ["revenue", "ebitda", "amortization", "opex", "employment_expenses", "operating_income", "interest_expenses", "net_income"]
 important_stats = ['revenue', 'ebitda', 'operating_income', 'net_income', 'capex', 'fcf', 'div_yield', 'assets', 'debt', 'cash', 'eps', 'ebitda_margin', 'net_margin', 'roe', 'roa', 'p_e', 'p_bv', 'ev_ebitda', 'debt_ebitda', 'capex_revenue']
 years = ['2020', '2021', '2022', '2023', '2024']
 
+def _cache_path(url):
+    return os.path.join(cache_dir, urllib.parse.quote(url, safe='') + '.html')
+
+def _host_semaphore(host):
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(max_connections_per_host)
+        return _host_semaphores[host]
+
+def _connection(scheme, host):
+    # У каждого потока свои соединения, http.client сам переоткрывает закрытое соединение
+    if not hasattr(_connections, 'pool'):
+        _connections.pool = {}
+    key = (scheme, host)
+    if key not in _connections.pool:
+        if scheme == 'https':
+            _connections.pool[key] = http.client.HTTPSConnection(host, context=ctx, timeout=timeout)
+        else:
+            _connections.pool[key] = http.client.HTTPConnection(host, timeout=timeout)
+    return _connections.pool[key]
+
+def http_get(url):
+    '''
+    GET request over the pooled keep-alive connection of the current thread,
+    follows redirects and retries 429/5xx responses and broken connections with exponential backoff
+    '''
+    for attempt in range(retries + 1):
+        count('smartlab: requests')
+        if attempt:
+            count('smartlab: retries')
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        conn = _connection(parts.scheme, parts.netloc)
+        retry_after = None
+        with _host_semaphore(parts.netloc), timed('smartlab: http'):
+            try:
+                conn.request('GET', path, headers={**headers, 'Accept-Encoding': 'gzip'})
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if attempt == retries:
+                    raise
+                response = None
+        if response is not None:
+            if response.status == 200:
+                count('smartlab: bytes', len(body))
+                if response.getheader('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                return body
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            if response.status not in (429, 500, 502, 503, 504) or attempt == retries:
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+            retry_after = response.getheader('Retry-After')
+        delay = backoff * 2 ** attempt
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        time.sleep(delay)
+    raise urllib.error.URLError(f'Too many redirects or retries for {url}')
+
+def has_smartlab_table(html):
+    '''
+    True if the page has the table of financial indicators that parse_smartlab_table reads
+    (the page of an unknown ticker, captcha or error page returned with 200 do not have it)
+    '''
+    return b'header_row' in html and b'field=' in html
+
+def prune_cache(max_age=None):
+    '''
+    removes the pages older than max_age seconds (cache_max_age by default) and unfinished temporary files from the cache
+    '''
+    max_age = cache_max_age if max_age is None else max_age
+    if not os.path.isdir(cache_dir):
+        return
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            age = now - os.path.getmtime(path)
+            if (name.endswith('.html') and age > max_age) or (name.endswith('.tmp') and age > 3600):
+                os.remove(path)
+        except OSError:
+            pass
+
+def download_html(url):
+    '''
+    downloads the page and saves it to the cache, only if it has the table of financial indicators
+    '''
+    global _pruned
+    html = http_get(url)
+    if not has_smartlab_table(html):
+        count('smartlab: pages without table')
+        return html
+    if not _pruned:
+        _pruned = True
+        prune_cache()
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(url)
+    # Сначала пишем во временный файл, чтобы параллельное чтение не увидело половину страницы
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(html)
+    os.replace(tmp_path, path)
+    return html
+
+def _refresh_in_background(url):
+    with _refreshing_lock:
+        if url in _refreshing:
+            return
+        _refreshing.add(url)
+
+    def refresh():
+        try:
+            download_html(url)
+        except Exception:
+            pass
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(url)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+def fetch_html(url, ttl=None, offline_mode=None, stale_while_revalidate=True):
+    '''
+    Returns html of the page from the disk cache and downloads it only if there is no fresh copy
+    ttl - seconds while the cached page is fresh (cache_ttl by default)
+    offline_mode - use only the cached pages, however old they are (offline by default)
+    stale_while_revalidate - return the stale page at once and refresh it in the background instead of waiting for the network
+    '''
+    ttl = cache_ttl if ttl is None else ttl
+    offline_mode = offline if offline_mode is None else offline_mode
+    path = _cache_path(url)
+
+    if os.path.exists(path):
+        age = time.time() - os.path.getmtime(path)
+        if offline_mode or age < ttl or stale_while_revalidate:
+            with open(path, 'rb') as f:
+                html = f.read()
+            if not offline_mode and age >= ttl:
+                count('smartlab: cache stale')
+                _refresh_in_background(url)
+            else:
+                count('smartlab: cache hits')
+            return html
+    elif offline_mode:
+        raise FileNotFoundError(f'There is no cached page for {url} in {cache_dir}')
+
+    count('smartlab: cache misses')
+    return download_html(url)
+
+def horizontal_analysis(df, newest_first=True, decimals=2):
+    '''
+    Vectorized horizontal analysis: growth (in %) of every period against the previous one
+    df - DataFrame with periods in columns (any number of them), rows can be line items of one or many companies
+    newest_first - True if the newest period is the first column (as in БФО), False if the last (as on smart-lab)
+    decimals - rounding of the result, None to keep it as is
+    Returns numeric DataFrame labelled by the current period of every pair, growth from zero or NaN is NaN
+    '''
+    values = df.to_numpy(dtype=float)
+    if newest_first:
+        curr, prev, cols = values[:, :-1], values[:, 1:], df.columns[:-1]
+    else:
+        curr, prev, cols = values[:, 1:], values[:, :-1], df.columns[1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = (curr / prev - 1) * 100
+    growth[~np.isfinite(growth)] = np.nan
+    if decimals is not None:
+        growth = np.round(growth, decimals)
+    return pd.DataFrame(growth, index=df.index, columns=cols)
+
+def vertical_analysis(df, base, absolute=False, decimals=2):
+    '''
+    Vectorized vertical analysis: share (in %) of every line item in the base item of the same period
+    df - DataFrame with periods in columns
+    base - Series with the base value for every period (revenue, total assets, ...)
+           or DataFrame of them indexed by one of the index levels of df (e.g. company) for panels
+    absolute - take the shares by absolute value (expenses are negative in БФО)
+    '''
+    if isinstance(base, pd.DataFrame):
+        share = df.div(base, level=base.index.name) * 100
+    else:
+        share = df.div(base, axis=1) * 100
+    share = share.astype(float).replace([np.inf, -np.inf], np.nan)
+    if decimals is not None:
+        share = share.round(decimals)
+    if absolute:
+        share = share.abs()
+    return share
+
+@timed('smartlab: parse')
+def parse_smartlab_table(html, parser=None):
+    '''
+    Walks the fundamentals table of the smart-lab page once and parses all its numeric cells in bulk
+    parser - BeautifulSoup backend (html_parser by default)
+    Returns DataFrame with all the indicators (field attribute of the rows) in rows and years in columns
+    and Series with the names of the indicators
+    '''
+    # Разбираем только строки таблиц, остальная страница в дерево не попадает
+    soup = BeautifulSoup(html, parser or html_parser, parse_only=SoupStrainer('tr'))
+
+    # Определяем реальные годы по заголовку таблицы
+    header_row = soup.find('tr', class_='header_row')
+    site_years = [cell.get_text(strip=True).replace('?', '') for cell in header_row.find_all('td')]
+
+    fields, names, texts = [], [], []
+    seen = set()
+    for row in soup.find_all('tr', attrs={'field': True}):
+        field = row['field']
+        if field in seen:
+            continue
+        seen.add(field)
+        fields.append(field)
+        th = row.find('th')
+        names.append(th.get_text(strip=True) if th is not None else field)
+        cells = [td.get_text(strip=True) for td in row.find_all('td')][:len(site_years)]
+        texts.extend(cells + [''] * (len(site_years) - len(cells)))
+
+    values = pd.to_numeric(pd.Series(texts, dtype=object).str.replace('%', '').str.replace(' ', ''), errors='coerce')
+    values = values.to_numpy(dtype=float).reshape(len(fields), len(site_years))
+
+    # Если год в заголовке повторяется, берем первый столбец с ним
+    first_cols = [site_years.index(year) for year in dict.fromkeys(site_years)]
+    table = pd.DataFrame(values[:, first_cols], index=fields, columns=[site_years[i] for i in first_cols])
+    return table, pd.Series(names, index=fields)
+
 def get_smartlab_statements(ticker, statements=important_stats, target_years=years, translation=True, types='MSFO', horizontal_an=False):
     '''
     Takes ticker of the company and turns it into URL from smart-lab.ru section of the given company and returns DataFrame of the desired statement
     ticker - string, company's official ticker
-    statements - array of the strings of financial indicators
+    statements - array of the strings of financial indicators (None - all the indicators on the page)
     years - array of the desired years
     translations_IS - array of the convinient translation of indexes
     types - a string (only MSFO ans RSBU are posssible)
@@ -31,70 +295,49 @@ def get_smartlab_statements(ticker, statements=important_stats, target_years=yea
         return print('ERROR: entered type should be either MSFO or RSBU')
             
     try:   
-        url = f'https://smart-lab.ru/q/{ticker}/f/y/{types}/'
-        req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req, context=ctx) as response:
-            html = response.read()
-        soup = BeautifulSoup(html, 'html.parser')
+        url = f'{base_url}/q/{ticker}/f/y/{types}/'
+        html = fetch_html(url)
+        table, translations = parse_smartlab_table(html)
     except:
         return print('Ticker is invalid')
 
-    # Определяем реальные годы по заголовку таблицы
-    header_row = soup.find('tr', class_='header_row')
-    header_cells = header_row.find_all('td')
-    site_years = [cell.get_text(strip=True).replace('?', '') for cell in header_cells]
-    
-    fm = pd.DataFrame(index=statements, columns=target_years)
-    translations = []
-    
-    # Обрабатываем каждый показатель
+    # Вся таблица уже разобрана, нужные показатели и годы только выбираются из нее
+    if statements is None:
+        statements = table.index
     for st in statements:
-        row = soup.find('tr', {'field': st})
-        if row is None:
+        if st not in table.index:
             print(f'There is no {st.upper()} for {ticker} in {types}')
-            fm = fm.drop(st)
-            continue
-        tds = row.find_all('td')
-        ths = row.find('th').get_text(strip=True)
-        translations.append(ths)
-        values = []
-    
-        for td in tds:
-            text = td.get_text(strip=True).replace('%', '').replace(' ', '')
-            try:
-                val = float(text)
-            except ValueError:
-                val = np.nan
-            values.append(val)
-    
-        # Сопоставим значения с годами (только нужные годы)
-        for year in target_years:
-            if year in site_years:
-                idx = site_years.index(year)
-                if idx < len(values):
-                    fm.loc[st, year] = values[idx]
+    statements = [st for st in statements if st in table.index]
+    fm = table.reindex(index=statements, columns=target_years)
 
     # Перевод 
     if translation:
-        fm.index = translations  
+        fm.index = translations[statements].to_numpy()
 
     # Горизонтальный анализ
     if horizontal_an:
-        hor_an_dt = fm.copy()
-        hor_an_dt = hor_an_dt.drop(hor_an_dt.columns[0], axis=1)
-        for row in hor_an_dt.index:
-            for i in range(1, len(fm.columns)):
-                year_prev = fm.columns[i - 1]
-                year_curr = fm.columns[i]
-                prev_val = float(fm.loc[row, year_prev])
-                curr_val = float(fm.loc[row, year_curr])
-        
-                if pd.notna(prev_val) and prev_val != 0:
-                    growth = (curr_val - prev_val) / prev_val * 100
-                    hor_an_dt.loc[row, year_curr] = f'{round(growth, 2)}%'
-                else:
-                    hor_an_dt.loc[row, year_curr] = np.nan
+        hor_an_dt = horizontal_analysis(fm, newest_first=False)
         hor_an_dt.columns = [f"{col} изм (%)" for col in hor_an_dt.columns]
         fm = pd.concat([fm, hor_an_dt], axis=1)
            
     return fm
+
+
+def get_smartlab_many(tickers, statements={'RSBU': important_stats, 'MSFO': important_stats}, target_years=years, translation=True, max_workers=8):
+    '''
+    Downloads and parses smart-lab pages of many companies concurrently and returns one DataFrame
+    with (ticker, type, indicator) index, the pages are requested in parallel over pooled connections
+    tickers - array of the tickers
+    statements - dict {type: array of the indicators}, type is MSFO or RSBU
+    Tickers that are not found are skipped
+    '''
+    jobs = [(ticker, types, stats) for ticker in tickers for types, stats in statements.items()]
+    # Каждой задаче своя копия контекста, чтобы замеры из потоков попали в замеры текущего запуска
+    contexts = [contextvars.copy_context() for _ in jobs]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool, timed('smartlab: download and parse'):
+        results = pool.map(lambda job, context: context.run(get_smartlab_statements, job[0], statements=job[2], target_years=target_years,
+                                                            translation=translation, types=job[1]), jobs, contexts)
+        frames = {(ticker, types): fm for (ticker, types, _), fm in zip(jobs, results) if fm is not None}
+    if not frames:
+        return pd.DataFrame(columns=target_years)
+    return pd.concat(frames, names=['ticker', 'type', 'indicator'])
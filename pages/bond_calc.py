@@ -1,104 +1,39 @@
+from io import BytesIO
+
 import pandas as pd
-import numpy as np
 import streamlit as st
-
-def discount(t, r):
-    return pd.Series([(1+r)**-i for i in t], index=t)
-
-def pv(flows, r):
-    discounts = discount(flows.index, r)
-    return (discounts * flows).sum()
-
-def inst_to_ann(r):
-    return np.expm1(r)
-
-def ann_to_inst(r):
-    return np.log1p(r)
-
-def bond_cash_flows(maturity=10, principal=1000, coupon_rate=0.03, coupons_per_year=12):
-    n_coupons = maturity*coupons_per_year
-    coupon_amt = principal*coupon_rate/coupons_per_year
-    coupon_times = np.arange(1, n_coupons+1)
-    cash_flows = pd.Series(data=coupon_amt, index=coupon_times)
-    cash_flows.iloc[-1] += principal
-    return cash_flows
-
-def bond_price(maturity=10, principal=1000, coupon_rate=0.03, coupons_per_year=12, discount_rate=0.03):
-    if isinstance(discount_rate, pd.DataFrame):
-        pricing_dates = discount_rate.index
-        prices = pd.DataFrame(index = pricing_dates, columns = discount_rate.columns)
-        for t in pricing_dates:
-            prices.loc[t] = bond_price(maturity-t/coupons_per_year, principal, coupon_rate, coupons_per_year, discount_rate.loc[t])
-        return prices
-    else:
-        if maturity <= 0: return principal+principal*coupon_rate/coupons_per_year
-        cash_flows = bond_cash_flows(maturity, principal, coupon_rate, coupons_per_year)
-        return pv(cash_flows, discount_rate/coupons_per_year)
-
-def bond_current_yield(principal=1000, current_price=1000, coupon_rate=0.2):
-    annual_coupon_payment = coupon_rate * principal
-    return annual_coupon_payment/current_price
-
-def bond_ytm(maturity=10, principal=1000, current_price=950, coupon_rate=0.2):
-    """Пока очень упрощенная, без разных купонов, цен и тд"""
-    annual_coupon_payment = coupon_rate * principal
-    return (annual_coupon_payment+(principal-current_price)/maturity) / ((principal+current_price)/2)
-        
-def bond_total_return(monthly_prices, principal, coupon_rate, coupons_per_year):
-    coupons = pd.DataFrame(data = 0, index=monthly_prices.index, columns=monthly_prices.columns)
-    t_max = monthly_prices.index.max()
-    pay_date = np.linspace(12/coupons_per_year, t_max, int(coupons_per_year*t_max/12), dtype=int)
-    coupons.iloc[pay_date] = principal*coupon_rate/coupons_per_year
-    total_returns = (monthly_prices + coupons)/monthly_prices.shift()-1
-    return total_returns.dropna()
-
-def macaulay_duration(flows, discount_rate):
-    discounts = discount(flows.index, discount_rate)
-    discounted_flows = flows * discounts
-    weights = discounted_flows / discounted_flows.sum()
-    return np.average(flows.index, weights=weights) / 12
-
-def match_durations(cf_t, cf_s, cf_l, discount_rate):
-    d_t = macaulay_duration(cf_t, discount_rate)
-    d_s = macaulay_duration(cf_s, discount_rate)
-    d_l = macaulay_duration(cf_l, discount_rate)
-    return (d_l - d_t)/(d_l - d_s)
-
-def bond_summary(name='Облигация', principal=1000, maturity=10, current_price=1000, coupon_rate=0.03, coupons_per_year=12, discount_rate=0.03):
-    flows = bond_cash_flows(maturity, principal, coupon_rate, coupons_per_year)
-    market_price = bond_price(maturity, principal, coupon_rate, coupons_per_year, discount_rate)
-    current_yield = bond_current_yield(principal, current_price, coupon_rate)
-    ytm = bond_ytm(maturity, principal, current_price, coupon_rate)
-    mac_dur = macaulay_duration(flows, ytm/coupons_per_year)
-    return pd.DataFrame({
-        "Market Price": market_price,
-        "Current Yield": current_yield,
-        "YTM": ytm,
-        "Macaulay Duration": mac_dur
-    }, index = [name])
+from bonds import bond_summary, simulate_bond, YieldCurve, BondPortfolio, holdings_columns, value_holdings
+from profiling import timed, start_page_run, show_debug_panel
 
 # Функции для streamlit
 
-def add_bond(summary_df):
-    """Добавляет рассчитанную облигацию в общий портфель (session_state)."""
+def get_portfolio():
+    """Портфель облигаций текущей сессии (session_state)."""
     if "bond_portfolio" not in st.session_state:
-        st.session_state["bond_portfolio"] = pd.DataFrame()
+        st.session_state["bond_portfolio"] = BondPortfolio()
+    return st.session_state["bond_portfolio"]
 
-    st.session_state["bond_portfolio"] = pd.concat(
-        [st.session_state["bond_portfolio"], summary_df]
-    )
+def add_bond(summary_df):
+    """Добавляет рассчитанную облигацию в общий портфель."""
+    get_portfolio().add(summary_df.index.tolist(), summary_df)
 
 def clear_portfolio():
     """Полностью очищает портфель облигаций."""
-    st.session_state["bond_portfolio"] = pd.DataFrame()
+    get_portfolio().clear()
+
+def remove_bond(bond_ids):
+    """Удаляет облигации из портфеля по id."""
+    get_portfolio().remove(bond_ids)
 
-def remove_bond(name):
-    """Удаляет облигацию из портфеля по имени."""
-    if "bond_portfolio" in st.session_state and not st.session_state["bond_portfolio"].empty:
-        st.session_state["bond_portfolio"] = st.session_state["bond_portfolio"].drop(index=name, errors="ignore")
+def portfolio_bytes(portfolio):
+    """Портфель в формате .npz для скачивания."""
+    output = BytesIO()
+    portfolio.save(output)
+    return output.getvalue()
 
 
 # Тест облигаций
+timings = start_page_run(st, 'bond_calc')
 st.title("📉 Анализ облигаций")
 
 st.sidebar.header("Параметры облигации")
@@ -112,20 +47,33 @@ coupon_rate = st.sidebar.number_input("Купонная ставка (в дол
 coupons_per_year = st.sidebar.selectbox("Число выплат в год", [1, 2, 4, 12], index=3)
 discount_rate = st.sidebar.number_input("Дисконтная ставка (в долях)", min_value=0.0, max_value=1.0, value=0.18, step=0.001, format="%.3f")
 
+# Вместо одной ставки можно дисконтировать по кривой бескупонных ставок
+use_curve = st.sidebar.checkbox("Дисконтировать по кривой доходности")
+if use_curve:
+    zero_rates = st.sidebar.data_editor(
+        pd.DataFrame({"Срок (лет)": [0.25, 1.0, 3.0, 5.0, 10.0], "Ставка": [0.18, 0.17, 0.16, 0.155, 0.15]}),
+        num_rows="dynamic", key="zero_rates"
+    ).dropna()
+    interpolation = st.sidebar.selectbox("Интерполяция", ["linear", "log_linear"],
+                                         format_func={"linear": "Линейная по ставкам", "log_linear": "Постоянные форварды"}.get)
+
+discount = YieldCurve(zero_rates["Срок (лет)"], zero_rates["Ставка"], interpolation) if use_curve else discount_rate
+
 calc = st.sidebar.button('Рассчитать')
 
 # Кнопка расчёта
 if calc:
     try:
-        summary = bond_summary(
-            name=name,
-            principal=principal,
-            maturity=maturity,
-            current_price=current_price,
-            coupon_rate=coupon_rate,
-            coupons_per_year=coupons_per_year,
-            discount_rate=discount_rate
-        )
+        with timed('bonds: summary'):
+            summary = bond_summary(
+                name=name,
+                principal=principal,
+                maturity=maturity,
+                current_price=current_price,
+                coupon_rate=coupon_rate,
+                coupons_per_year=coupons_per_year,
+                discount_rate=discount
+            )
         st.session_state["last_summary"] = summary
         if "last_summary" in st.session_state:
             add_bond(st.session_state["last_summary"])
@@ -134,10 +82,47 @@ if calc:
         st.error(f"Ошибка при расчете: {e}")
 
 
+# Импорт облигаций из файла
+with st.expander("📥 Импорт облигаций из файла"):
+    st.caption("Столбцы: " + ", ".join(holdings_columns) + ". Если в файле нет дисконтной ставки, "
+               "используется ставка (или кривая) из боковой панели.")
+    holdings_file = st.file_uploader("CSV или XLSX с облигациями", type=["csv", "xlsx"])
+    if holdings_file is not None and st.button("Импортировать"):
+        status = st.empty()
+        last_chunk = st.empty()
+        errors = []
+        imported = 0
+        try:
+            with timed('bonds: import'):
+                # Строки оцениваются и добавляются в портфель пачками, ошибочные строки пропускаются
+                for summaries, chunk_errors, rows_read in value_holdings(holdings_file, discount_rate=discount):
+                    timings.count('bonds: imported rows', len(summaries) + len(chunk_errors))
+                    get_portfolio().add(summaries.index.tolist(), summaries)
+                    imported += len(summaries)
+                    errors.append(chunk_errors)
+                    status.write(f"Прочитано строк: {rows_read}, добавлено облигаций: {imported}, "
+                                 f"строк с ошибками: {rows_read - imported}")
+                    last_chunk.dataframe(summaries.style.format("{:,.4f}"))
+        except Exception as e:
+            st.error(f"Ошибка при импорте: {e}")
+        st.session_state["import_errors"] = pd.concat(errors) if errors else None
+    if st.session_state.get("import_errors") is not None and not st.session_state["import_errors"].empty:
+        st.warning("Строки с ошибками не импортированы:")
+        st.dataframe(st.session_state["import_errors"])
+
+
 # Управление портфелем
-if "bond_portfolio" in st.session_state and not st.session_state["bond_portfolio"].empty:
+portfolio = get_portfolio()
+if len(portfolio):
     st.subheader("📊 Результаты анализа")
-    st.dataframe(st.session_state["bond_portfolio"].style.format("{:,.4f}"))
+    with timed('render: portfolio'):
+        st.dataframe(portfolio.frame().style.format("{:,.4f}", subset=BondPortfolio.columns))
+
+    totals = portfolio.aggregates()
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Рыночная стоимость", f"{totals['Market Value']:,.2f}")
+    m2.metric("Средневзвешенная YTM", f"{totals['YTM']:.2%}")
+    m3.metric("Средневзвешенная дюрация", f"{totals['Modified Duration']:.2f}")
 
     c1, c2 = st.columns(2)
 
@@ -147,13 +132,66 @@ if "bond_portfolio" in st.session_state and not st.session_state["bond_portfolio
         st.rerun()  # сразу перерисовываем страницу
 
     # --- Удаление отдельных облигаций через multiselect ---
+    frame = portfolio.frame()
     bonds_to_remove = c2.multiselect(
         "Удалить облигацию:",
-        st.session_state["bond_portfolio"].index.tolist(),
+        frame.index.tolist(),
+        format_func=lambda bond_id: f"{bond_id}: {frame.at[bond_id, 'Name']}",
         key="remove"
     )
 
     if bonds_to_remove:
-        st.session_state["bond_portfolio"] = st.session_state["bond_portfolio"].drop(index=bonds_to_remove)
+        remove_bond(bonds_to_remove)
         st.rerun()
 
+# Сохранение портфеля: файл скачивается и загружается пользователем, на сервер ничего не пишется
+with st.expander("💾 Сохранить / загрузить портфель"):
+    s1, s2 = st.columns(2)
+    s1.download_button(
+        "Сохранить",
+        data=lambda: portfolio_bytes(portfolio),
+        file_name="bond_portfolio.npz",
+        mime="application/octet-stream",
+        disabled=not len(portfolio),
+        on_click='ignore'
+    )
+    portfolio_file = s2.file_uploader("Файл портфеля (.npz)", type=["npz"])
+    if portfolio_file is not None and s2.button("Загрузить"):
+        try:
+            st.session_state["bond_portfolio"] = BondPortfolio.load(BytesIO(portfolio_file.getvalue()))
+            st.rerun()
+        except (OSError, KeyError, ValueError) as e:
+            st.error(f"Не удалось загрузить портфель: {e}")
+
+
+# Моделирование ставок методом Монте-Карло
+st.subheader("🎲 Моделирование ставок (Монте-Карло)")
+with st.form("monte_carlo"):
+    c1, c2, c3 = st.columns(3)
+    model = c1.selectbox("Модель", ["vasicek", "cir"], format_func={"vasicek": "Васичек", "cir": "CIR"}.get)
+    r0 = c1.number_input("Начальная ставка", min_value=0.0, max_value=1.0, value=discount_rate, step=0.001, format="%.3f")
+    a = c2.number_input("Скорость возврата к среднему (a)", min_value=0.0, max_value=10.0, value=0.5, step=0.05)
+    b = c2.number_input("Долгосрочная ставка (b)", min_value=0.0, max_value=1.0, value=discount_rate, step=0.001, format="%.3f")
+    sigma = c3.number_input("Волатильность (sigma)", min_value=0.0, max_value=1.0, value=0.05, step=0.005, format="%.3f")
+    n_scenarios = c3.number_input("Число сценариев", min_value=100, max_value=1_000_000, value=10_000, step=1000)
+    seed = c1.number_input("Seed", min_value=0, value=42, step=1)
+    antithetic = c2.checkbox("Антитетические сценарии", value=True)
+    simulate = st.form_submit_button("Смоделировать")
+
+if simulate:
+    if maturity < 1 / 12:
+        st.error("Срок до погашения должен быть не меньше месяца")
+    else:
+        with st.spinner("Моделирование..."), timed('bonds: simulate'):
+            rates_fan, prices_fan, returns = simulate_bond(
+                maturity, principal, coupon_rate, coupons_per_year, n_scenarios=int(n_scenarios),
+                model=model, r0=r0, a=a, b=b, sigma=sigma, n_years=maturity, seed=int(seed), antithetic=antithetic
+            )
+        st.write("Процентили ставки по месяцам")
+        st.line_chart(rates_fan)
+        st.write("Процентили цены облигации по месяцам")
+        st.line_chart(prices_fan)
+        st.write("Процентили доходности за весь срок")
+        st.dataframe(returns.quantile([0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]).style.format("{:.2%}"))
+
+show_debug_panel(st, timings)
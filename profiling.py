@@ -0,0 +1,220 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ContextDecorator
+
+import pandas as pd
+
+logger = logging.getLogger('bfo.profiling')
+
+# Если задан BFO_TIMINGS_LOG, отчет каждого перезапуска дописывается в этот файл одной JSON-строкой
+timings_log = os.environ.get('BFO_TIMINGS_LOG')
+
+
+class Timings:
+    '''
+    Durations of the pipeline stages and counters of one run (one rerun of a streamlit page).
+    Thread-safe: stages from the worker threads of the same run are added here too
+    '''
+    def __init__(self, name='run'):
+        self.name = name
+        self.started = time.time()
+        self.stages = defaultdict(list)
+        self.counters = Counter()
+        self.profile = None
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage].append(seconds)
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def frame(self):
+        '''
+        DataFrame of the stages: number of calls, total, mean and max time in ms (in the order of the first call)
+        '''
+        with self._lock:
+            rows = {stage: [len(times), sum(times) * 1000, sum(times) / len(times) * 1000, max(times) * 1000]
+                    for stage, times in self.stages.items()}
+        return pd.DataFrame.from_dict(rows, orient='index', columns=['Вызовы', 'Всего, мс', 'Среднее, мс', 'Макс, мс'])
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'started': self.started,
+                'duration': time.time() - self.started,
+                'stages': {stage: {'calls': len(times), 'total': sum(times), 'max': max(times)} for stage, times in self.stages.items()},
+                'counters': dict(self.counters),
+                'profile': self.profile,
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+
+# Текущий сбор: у каждого перезапуска свой, в потоки пула он передается через contextvars.copy_context,
+# вне запуска (например, в скриптах) замеры никуда не пишутся
+_current = contextvars.ContextVar('timings', default=None)
+
+def current():
+    return _current.get()
+
+def start_run(name='run'):
+    timings = Timings(name)
+    _current.set(timings)
+    return timings
+
+def finish_run(timings):
+    '''
+    Writes the report of the run to the log (and to timings_log if it is set)
+    '''
+    report = timings.to_json()
+    logger.info(report)
+    if timings_log:
+        with open(timings_log, 'a', encoding='utf-8') as f:
+            f.write(report + '\n')
+    return report
+
+def count(counter, n=1):
+    timings = _current.get()
+    if timings is not None:
+        timings.count(counter, n)
+
+
+class timed(ContextDecorator):
+    '''
+    Measures the time of the block or the function as the stage of the current run:
+        with timed('excel: parse'): ...
+        @timed('smartlab: parse')
+    '''
+    def __init__(self, stage):
+        self.stage = stage
+
+    def _recreate_cm(self):
+        # Декорированная функция может выполняться в нескольких потоках сразу, у каждого вызова свой замер
+        return timed(self.stage)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._start
+        timings = _current.get()
+        if timings is not None:
+            timings.add(self.stage, seconds)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s', json.dumps({'stage': self.stage, 'seconds': seconds}, ensure_ascii=False))
+        return False
+
+
+class SamplingProfiler:
+    '''
+    Sampling profiler of one thread (the one that calls start by default): a background thread looks
+    at its stack every interval seconds, so the profiled code is not slowed down like with cProfile
+    stats() - functions with the number of samples where they were on top of the stack (own time)
+    and anywhere in the stack (total time)
+    '''
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.own = Counter()
+        self.total = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id=None):
+        self._target = thread_id or threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                # Профилируемый поток завершился, а stop так и не вызвали
+                break
+            self.samples += 1
+            self.own[self._key(frame)] += 1
+            seen = set()
+            while frame is not None:
+                key = self._key(frame)
+                if key not in seen:
+                    seen.add(key)
+                    self.total[key] += 1
+                frame = frame.f_back
+
+    @staticmethod
+    def _key(frame):
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def stats(self, limit=30):
+        df = pd.DataFrame({'Собственные': pd.Series(self.own, dtype=int), 'Всего': pd.Series(self.total, dtype=int)}).fillna(0).astype(int)
+        df['Собственные, %'] = (df['Собственные'] / max(self.samples, 1) * 100).round(1)
+        df['Всего, %'] = (df['Всего'] / max(self.samples, 1) * 100).round(1)
+        return df.sort_values(['Собственные', 'Всего'], ascending=False).head(limit).rename_axis('Функция')
+
+
+def debug_enabled(st):
+    '''
+    The debug panel is shown if BFO_DEBUG=1 or the page is opened with ?debug=1
+    '''
+    return os.environ.get('BFO_DEBUG', '') == '1' or st.query_params.get('debug') == '1'
+
+def start_page_run(st, name):
+    '''
+    Starts the timings of the streamlit rerun, and the sampling profiler if it was requested in the debug panel
+    The profiler is kept in session_state until show_debug_panel stops it: if the previous run did not get there
+    (st.rerun or an exception), its profiler is stopped here
+    '''
+    leftover = st.session_state.pop('sampling_profiler', None)
+    if leftover is not None:
+        leftover.stop()
+    timings = start_run(name)
+    if debug_enabled(st) and st.session_state.get('profile_next_run'):
+        timings.profiler = st.session_state['sampling_profiler'] = SamplingProfiler().start()
+    return timings
+
+def show_debug_panel(st, timings):
+    '''
+    Finishes the run and shows its stages, counters and profile in the sidebar (if the debug mode is on)
+    '''
+    if timings.profiler is not None:
+        timings.profiler.stop()
+        st.session_state.pop('sampling_profiler', None)
+        timings.profile = timings.profiler.stats().reset_index().to_dict('records')
+    report = finish_run(timings)
+    if not debug_enabled(st):
+        return
+
+    with st.sidebar.expander("🛠 Отладка: время выполнения", expanded=True):
+        stages = timings.frame()
+        st.caption(f"Перезапуск: {timings.to_dict()['duration'] * 1000:,.0f} мс")
+        if not stages.empty:
+            st.dataframe(stages.style.format("{:,.1f}", subset=['Всего, мс', 'Среднее, мс', 'Макс, мс']))
+        if timings.counters:
+            st.dataframe(pd.Series(timings.counters, name='Количество'))
+        if timings.profile:
+            st.write("Профиль (выборки стека)")
+            st.dataframe(pd.DataFrame(timings.profile).set_index('Функция'))
+        st.checkbox("Профилировать следующий перезапуск", key='profile_next_run')
+        st.download_button("Скачать JSON", data=report.encode('utf-8'), file_name="timings.json", mime="application/json")